@@ -1,105 +1,154 @@
 from discord.ext import commands
 import discord
-import json
 import os
 import re
+import math
 import datetime
-import pytz
+import time
 import logging
 import asyncio
 from dotenv import load_dotenv
+import detection
+import conversion
+import tztables
+import storage
+import logqueue
+import metrics
+import outbox
+import resolver
+import edits
+import welcome
+import health
+import profiler
+import offload
+import admission
 
 # Settings -------------------------------------------------------------------------
-SAFEMODE = True  # This should never be disabled, realistically speaking
 BOT_PREFIX = '-'  # Sets the prefix character(s) for bot commands
 
 # Advanced Settings ----------------------------------------------------------------
 VERSION = "2.0"  # Sets bot version, used when loading and writing json files
+STORAGE_BACKEND = "json"  # Where guilds are stored: json (guilds.json) or sqlite (guilds.db)
 LOGGING_LEVEL = logging.INFO  # Sets the logging level: DEBUG, INFO, WARNING, ERROR, CRITICAL
+SHARDED = False  # Run every shard Discord recommends in this process, launcher.py runs shards across processes instead
+DEVELOPER_ID = "192872910103248897"  # User allowed to use the developer commands (stop, stats)
+WORD_LIST_LIMIT = 200  # Words a guild can add to a single word list
+MEMBER_EVENTS = False  # Remove users' records when they leave a guild, needs the Server Members intent enabled for the bot
+COMPACT_INTERVAL = 21600  # Seconds between passes removing inactive records unseen for storage.INACTIVE_TTL days
+EXIT_LOAD_FAILED = 3  # Exit code when guilds can't be loaded, launcher.py restarts the worker, 0 is the stop command
+OFFLOAD = False  # Parse large messages, or every message while the event loop is behind, in worker processes, see offload.py
 
 # Initialization -------------------------------------------------------------------
 # Get token from environment variable
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
-# Variables to store data from guilds.json
-guilds = {}
+# Set by launcher.py for each worker process: the shards this worker owns out of SHARD_COUNT
+SHARD_IDS = os.getenv('SHARD_IDS')  # Comma separated shard IDs
+SHARD_COUNT = os.getenv('SHARD_COUNT')
+WORKER_ID = os.getenv('WORKER_ID')
+if os.getenv('STORAGE_BACKEND') is not None:
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND')
 
-# Logger config, https://stackoverflow.com/questions/28330317/print-timestamp-for-logging-in-python,
-# https://stackoverflow.com/questions/13733552/logger-configuration-to-log-to-file-and-print-to-stdout
-logging.basicConfig(filename="RealTimeBot.log",
-                    # encoding="utf-8",
-                    level=LOGGING_LEVEL,
-                    datefmt='%Y-%m-%d %H:%M:%S',
-                    format='%(asctime)s %(levelname)-8s %(message)s')
+# Workers keep their own log and metrics files, they can't share a rotating file
+if WORKER_ID is not None:
+    logqueue.LOG_FILE = "RealTimeBot.worker{}.log".format(WORKER_ID)
+    welcome.WELCOMED_FILE = "welcomed.worker{}.bin".format(WORKER_ID)
+    health.HEALTH_PORT += 1 + int(WORKER_ID)
+    health.STALL_FILE = "stalls.worker{}.log".format(WORKER_ID)
+    metrics.METRICS_FILE = "metrics.worker{}.prom".format(WORKER_ID)
 
-# Will cause all output to log to console for the remainder of any SSH sessions
-#logging.getLogger().addHandler(logging.StreamHandler())  # Log to console as well as the file
+# Storage backend holding guild and user records, see storage.py
+guilds = None
+
+# Background task writing guilds.json, started on the first on_ready
+saveTask = None
 
-# Word List & Regex Setup -----------------------------------------------------------------
-# TODO Add ability to modify these lists with commands
-# Lists of words which may indicate a match
-words_before_positive = ["at", "around", "about", "for", "probably", "from", "by", "until"]
-words_after_positive = ["am", "pm", "to"]
+# Background task writing metrics.prom, started on the first on_ready
+metricsTask = None
 
-# Lists of words which may indicate the detection is not a match
-words_before_negative = ["in"]
-words_after_negative = ["minutes", "hours", "minute", "hour", "min", "mins", "days", "weeks", "months", "years", "percent", "%", "k",]
+# Background tasks writing welcomed.bin and compacting guilds, started on the first on_ready
+welcomeTask = None
+compactTask = None
 
-# If SAFEMODE is disabled, add some riskier words
-if not SAFEMODE:
-    words_before_positive.extend(['', "like"])
+# Logger config, records are queued and written to a rotating RealTimeBot.log by a background thread, see logqueue.py
+logqueue.start(LOGGING_LEVEL)
 
-# Regex patterns for the on_message handler
-timeMatch_regex = re.compile("(\\b\\w*\\b)?\\s*([0-9]{1,2}:[0-9]{1,2}|[0-9]{1,4})\\s?([a-z]+|$|.?)?", re.IGNORECASE)
-timeMatch_removeDecimal = re.compile("[0-9]+\\.[0-9]+")
+# Per message events, sampled by logqueue.LOG_SAMPLING
+message_log = logging.getLogger("RealTimeBot.message")
+
+# Will cause all output to log to console for the remainder of any SSH sessions
+#logging.getLogger().addHandler(logging.StreamHandler())  # Log to console as well as the file
 
 # Bot initialization
-bot = commands.Bot(command_prefix=BOT_PREFIX)
+intents = discord.Intents.default()
+intents.members = MEMBER_EVENTS
+if SHARD_COUNT is not None:
+    bot = commands.AutoShardedBot(command_prefix=BOT_PREFIX, intents=intents, shard_count=int(SHARD_COUNT),
+                                  shard_ids=[int(shardID) for shardID in SHARD_IDS.split(",")])
+    logging.info("Worker %s running shards %s of %s", WORKER_ID, SHARD_IDS, SHARD_COUNT)
+elif SHARDED:
+    bot = commands.AutoShardedBot(command_prefix=BOT_PREFIX, intents=intents)
+else:
+    bot = commands.Bot(command_prefix=BOT_PREFIX, intents=intents)
 
 @bot.event
 async def on_ready():
-    logging.info("Connection established: " + str(bot.user))
+    logging.info("Connection established: %s", bot.user)
 
-    # Load users.json and guilds.json
-    global guilds
-    try:
-        file_guilds = open("guilds.json", 'r')
-        guilds = json.load(file_guilds)
-        file_guilds.close()
-
-        # guilds.json notes:
-        # Outermost level: Guild IDs
-        # Next level: "timezones" and "users"
-        # timezones --> contains all server timezones which need to be displayed
-        # users --> User IDs
-        # Next level: "timezone" and "active"
-        # timezone --> User's timezone
-        # active --> User's opt-in/opt-out status, boolean
+    # on_ready fires again after every reconnect, guilds were loaded once before connecting, see loadGuilds
 
-    except:
-        logging.exception("An error occurred while loading guilds.json")
-        logging.critical("This program will now terminate")
-        exit(0)
+    # Start writing changes in the background
+    global saveTask
+    if saveTask is None:
+        saveTask = bot.loop.create_task(guilds.saveLoop())
 
-    # Check json version
-    if not str(guilds["version"]) == VERSION:
-        logging.warning("guilds.json version is {}, RealTimeBot.py version is {}, errors may occur".format(guilds["version"], VERSION))
+    # Start dumping metrics in the background
+    global metricsTask
+    if metricsTask is None:
+        metricsTask = bot.loop.create_task(metrics.dumpLoop())
+
+    # Start writing welcomed users and removing stale records in the background
+    global welcomeTask, compactTask
+    if welcomeTask is None:
+        welcomeTask = bot.loop.create_task(welcome.saveLoop())
+        compactTask = bot.loop.create_task(compactLoop())
+
+        # Start the health endpoint and the event loop watchdog
+        health.start(bot.loop, healthStatus)
 
 
 # Bot events -------------------------------------------------------------------------------
 @bot.event
 async def on_guild_join(guild):
     # Create a record for this guild in guilds if one doesn't exist already
-    if not str(guild.id) in guilds:
-        guilds[str(guild.id)] = {"timezones": [], "users": {}}
+    if not guilds.hasGuild(str(guild.id)):
+        guilds.addGuild(str(guild.id))
+
+    logging.info("Created new guild record for guild: %s", guild.id)
+
+@bot.event
+async def on_guild_remove(guild):
+    # Drop the guild's record and every user in it, a guild which adds the bot back starts over
+    guildID = str(guild.id)
+    if guilds.hasGuild(guildID):
+        users = guilds.removeGuild(guildID)
+        detection.word_cache.pop(guildID, None)
+        logging.info("Removed guild record for guild %s with %s users", guildID, users)
 
-    logging.info("Created new guild record for guild: {}".format(guild.id))
+@bot.event
+async def on_member_remove(member):
+    # Only dispatched with MEMBER_EVENTS enabled
+    guildID = str(member.guild.id)
+    if guilds.hasGuild(guildID) and guilds.getUser(guildID, member.id) is not None:
+        guilds.removeUser(guildID, member.id)
+        logging.info("Removed user record for %s, who left guild %s", member.id, guildID)
 
 @bot.event
 async def on_message(message):
     # Grab the message out of the context object
     message_content = str(message.content)
+    start = time.perf_counter()
 
     # Temporary handler to protect DBS
     # if str(str(message.guild.id)) is not "283141733896945664":
@@ -107,198 +156,213 @@ async def on_message(message):
 
     # Check for a bot message
     if message.author.bot:
-        logging.debug("Disregarding bot message")
+        message_log.debug("Disregarding bot message")
+        return
+
+    # Direct messages have no guild to convert for or count against, only their commands are run
+    if message.guild is None:
+        if message_content.startswith(BOT_PREFIX):
+            await bot.process_commands(message)
         return
 
     # Check for commands
+    guildID = str(message.guild.id)
+    metrics.countMessage(guildID)
     if message_content.startswith(BOT_PREFIX):
         logging.debug("on_message sending to process_commands due to BOT_PREFIX")
-        await bot.process_commands(message)
+        metrics.counters["commands"] += 1
+        # Far behind, only the commands in admission.ESSENTIAL_COMMANDS are served
+        if admission.shedCommand(message_content, BOT_PREFIX):
+            message_log.info("Dropping command under load: %s", message_content)
+            return
+        # Commands wait for the offloaded messages ahead of them in the channel, see offload.py
+        # They are parsed first, discord.py updates the message in place if it is edited while it waits
+        if offload.needsPlace(message.channel.id, False):
+            await inLine(message.channel.id, bot.invoke, await bot.get_context(message))
+        else:
+            await bot.process_commands(message)
         return
+    # Behind, old messages are dropped, their conversion would come too late to help anyone, see admission.py
+    if admission.shedMessage(message.created_at):
+        message_log.info("Dropping message %s under load, it is too old", message.id)
+        return
+    scanStart = time.perf_counter()
+    metrics.observe("prefix", scanStart - start, guildID)
+
+    # The prefilter runs here, expensive messages with candidates, or every one while the loop is behind, are
+    # scanned in a worker process, see offload.py
+    # Their replies, and those of later messages in the same channel, are sent in the order the messages came in
+    windows = detection.prefilterWindows(message_content)
+    offloaded = offload.shouldOffload(message_content, windows, health.last_lag)
+    if not offload.needsPlace(message.channel.id, offloaded):
+        await processMessage(message, guildID, scanStart, windows, False, None)
+        return
+    previous, done = offload.takePlace(message.channel.id)
+    try:
+        await processMessage(message, guildID, scanStart, windows, offloaded, previous)
+    finally:
+        offload.leave(message.channel.id, previous, done)
 
-    # Strip commas, convert to lowercase, remove decimals
-    message_content.replace(",", "")
-    message_content = message.content.lower()
-    message_content = re.sub(timeMatch_removeDecimal, '', message_content)
 
-    # Search for matches
-    matches = re.findall(timeMatch_regex, message_content)
-    logging.debug("Processing message: " + message_content)
+# Scans a message for times and replies to it, everything on_message does past the command check
+# previous is the future of the message ahead in the channel's line, awaited before the user is checked, see
+# offload.takePlace
+async def processMessage(message, guildID, scanStart, windows, offloaded, previous):
+    message_content = str(message.content)
+
+    # Search for matches, only opted in users' matches are converted in the worker, with the user, guild zones and
+    # words as they are now, which are checked again once the message's turn comes
+    senderZone = guildZones = words = None
+    if offloaded:
+        user = guilds.getUser(guildID, message.author.id)
+        if user is not None and user[1]:
+            senderZone = user[0]
+        guildZones = list(guilds.getTimezones(guildID))
+        words = guildWords(guildID)
+        matches, toSend = await offload.parse(message_content, windows, senderZone, guildZones,
+                                              message.created_at.replace(tzinfo=datetime.timezone.utc), words)
+        metrics.counters["offloaded"] += 1
+        # Time spent waiting on the worker isn't charged to the guild
+        metrics.observe("scan", time.perf_counter() - scanStart)
+    else:
+        matches = detection.scanWindows(message_content, windows)
+        metrics.observe("scan", time.perf_counter() - scanStart, guildID)
+    detection.countScanned(windows, matches)
+    metrics.matches_per_message.observe(len(matches))
 
     # Check for matches
-    if len(matches) is 0:
-        logging.info("No matches found in message: " + message_content)
+    if len(matches) == 0:
+        message_log.debug("No matches found in message: %s", message_content)
         return
 
+    # The user is only checked once the messages and commands ahead of this one in the channel are done,
+    # a -timezone or -opt_out sent before this message has to apply to it
+    if previous is not None:
+        await previous
+    checkStart = time.perf_counter()
+
+    # Remembered so an edit only redoes this when the matches change, see on_message_edit
+    processed = edits.remember(message.id, matches)
+
     # At least one possible match, check the user
-    userStatus = checkUser(str(message.author.id), str(message.guild.id))
-    if userStatus is -1:
-        logging.error("Aborting time conversion for user {} due to invalid userStatus return".format(message.author.id))
+    userStatus = checkUser(message.author.id, guildID)
+    convertStart = time.perf_counter()
+    metrics.observe("check_user", convertStart - checkStart, guildID)
+    if userStatus == -1:
+        logging.error("Aborting time conversion for user %s due to invalid userStatus return", message.author.id)
         return
-    elif userStatus is 0:
-        await message.channel.send("Howdy, {}! If you would like to opt-in to automatic timezone conversion for your "
-                                   "messages, use '-timezone est|cst|mt|pst' to set your timezone"
-                                    .format(message.author.name))
+    elif userStatus == 0:
+        # Welcomes are the first thing shed under load, a later message welcomes the user instead
+        if admission.shedWelcome():
+            message_log.info("Skipping welcome for user %s under load", message.author.id)
+            return
+        logging.info("Welcoming user %s", message.author.id)
+        welcome.markWelcomed(guildID, message.author.id)
+        await outbox.send(message.channel, "Howdy, {}! If you would like to opt-in to automatic timezone conversion for "
+                                         "your messages, use '-timezone est|cst|mt|pst' or a city such as "
+                                         "'-timezone berlin' to set your timezone".format(message.author.name))
         return
-    elif userStatus is 1:
+    elif userStatus == 1:
         # User has opted out, return
-        logging.info("Ignoring message, user has opted out")
+        message_log.info("Ignoring message, user has opted out")
         return
     #elif userStatus is 2:
         # User has opted in, continue
 
-    # Message to send to server with converted times
-    toSend = ""
+    # Look for times and convert them for every registered timezone in this guild
+    # Offloaded messages were converted in the worker, again here if the user or guild changed while they waited
+    if (senderZone is None or guilds.getUser(guildID, message.author.id)[0] != senderZone
+            or guilds.getTimezones(guildID) != guildZones or guildWords(guildID) is not words):
+        toSend = convertMatches(message, matches, guildID)
+    metrics.observe("convert", time.perf_counter() - convertStart, guildID)
 
-    # Due to overlapping regex detection, this flag allows detection of times like "I'll be on from 8 to 9"
-    to_prior = False
-
-    # Look for times
-    for match in matches:
-        # match[0]: preceding word
-        # match[1]: number, may contain colon
-        # match[2]: following word
-
-        logging.info("Processing match: " + str(match))
-
-        # Boolean flags
-        positive = False
+    if len(toSend) != 0:
+        logging.info("Processing complete, sending message: %s", toSend)
+        processed.reply = await outbox.send(message.channel, toSend)
+        processed.content = toSend
+    else:
+        message_log.info("No times detected")
 
-        # Check for a colon, if found, skip this stage, else check words against list
-        if ":" not in match[1]:
-            # Check against negative words
-            if match[0] in words_before_negative:
-                logging.info("Negative word found, before, match aborted")
-                continue
-            elif match[2] in words_after_negative:
-                logging.info("Negative word found, after, match aborted")
-                continue
+@bot.event
+async def on_message_edit(before, after):
+    # Embeds being added also fire an edit, only text changes matter, and edited commands aren't run again
+    message_content = str(after.content)
+    if after.author.bot or after.guild is None or before.content == after.content or message_content.startswith(BOT_PREFIX):
+        return
+    edits.edit_counters["edits"] += 1
 
-            # Check against positive words
-            if (match[0] in words_before_positive) or (match[2] in words_after_positive):
-                positive = True
-        else:
-            positive = True
-
-        # Check for to/to_prior
-        if to_prior:
-            to_prior = False
-            positive = True
-        if "to" in match[2]:
-            to_prior = True
-
-        # Check if a positive match was found, if not check for safemode, abort match if safemode = True
-        if not positive and SAFEMODE:
-            logging.info("Safe mode enabled, match aborted")
-            continue
+    # Edits wait for the offloaded messages ahead of them in the channel, the original may still be in a worker
+    # after is updated in place by later edits, each edit is handled with the content it brought
+    if offload.needsPlace(after.channel.id, False):
+        await inLine(after.channel.id, processEdit, after, message_content)
+    else:
+        await processEdit(after, message_content)
 
-        # Attempt to determine time
-        time = str(match[1])  # Ease of use
 
-        # Check for am/pm
-        am_pm = -1
-        if match[2] == "am":
-            am_pm = 0
-        elif match[2] == "pm":
-            am_pm = 1
+# Updates the reply to an edited message, or sends one if the edit added times
+async def processEdit(after, message_content):
+    # Messages without matches aren't remembered, recent ones are handled as if they had none
+    processed = edits.lookup(after.id)
+    if processed is None and not edits.recent(after.created_at):
+        edits.edit_counters["expired"] += 1
+        return
+    previous = () if processed is None else processed.matches
 
-        hour = -1
-        minute = -1
+    # Only parse and convert again if the edit changed the matches, fixing a typo elsewhere does nothing
+    matches = detection.findMatches(message_content, counted=False)
+    if tuple(matches) == previous:
+        edits.edit_counters["unchanged"] += 1
+        return
+    reply = None if processed is None else processed.reply
+    replyContent = None if processed is None else processed.content
+    processed = edits.remember(after.id, matches, reply, replyContent)
+
+    # Only opted in users get conversions, the welcome message was already sent for the original message
+    guildID = str(after.guild.id)
+    user = guilds.getUser(guildID, after.author.id)
+    if user is None or not user[1]:
+        return
+    toSend = convertMatches(after, matches, guildID) if len(matches) != 0 else ""
+    if toSend == replyContent:
+        edits.edit_counters["unchanged"] += 1
+        return
 
-        # Time assignment block
+    # Update the reply's lines in the message carrying it, or send one if the original message didn't get one
+    # A reply still queued in the outbox is waited for, it may be merged with the replies to other messages
+    sent = None if reply is None else await reply
+    if sent is not None:
         try:
-            if ":" in time:
-                time = time.split(':')
-                hour = int(time[0])
-                minute = int(time[1])
-            else:
-                # Attempt to split based on length of string
-                if len(time) is 1:
-                    hour = int(time)
-                    minute = 0
-                elif len(time) is 2:
-                    hour = int(time)
-                    minute = 0
-                elif len(time) is 3:
-                    hour = int(time[0])
-                    minute = int(time[1:3])
-                elif len(time) is 4:
-                    hour = int(time[0:2])
-                    minute = int(time[2:4])
-
-        except Exception as e:
-            logging.error("Exception in hour/minute assignment block", exc_info=e)
-            continue
-
-        logging.debug("hour:{}, minute:{}, am_pm:{}".format(hour, minute, am_pm))
-
-        # This shouldn't be possible, but best to double check
-        if hour is -1 or minute is -1:
-            logging.error("hour or minute is -1 beyond the time assignment block, match aborted")
-            continue
-
-        # Validate times
-        if minute > 59:
-            logging.info("Invalid minute, match aborted")
-            continue
-        if am_pm is -1:
-            if hour > 23:
-                logging.info("Invalid hour, match aborted")
-                continue
-        else:
-            if hour < 1 or hour > 12:
-                logging.info("Invalid hour, match aborted")
-                continue
-
-        # Grab the sender's timezone
-        sender_TZ = pytz.timezone(guilds[str(message.guild.id)]["users"][str(message.author.id)]["timezone"])
-
-        # If am_pm not specified by user, guess
-        if am_pm is -1 and hour < 13:
-            currentTime = datetime.datetime.now(sender_TZ)
-            currentHour = currentTime.hour
-            if currentHour > 12:
-                currentHour = currentTime.hour - 12
-
-            # If hour > currentHour, am/pm == am/pm local time
-            if hour > currentHour or (hour == currentHour and minute >= currentTime.minute):
-                if currentTime.hour < 12:
-                    am_pm = 0
-                else:
-                    am_pm = 1
-            else:
-                if currentTime.hour < 12:
-                    am_pm = 1
+            if await outbox.editReply(after.channel, sent, toSend):
+                if len(toSend) != 0:
+                    edits.edit_counters["updated"] += 1
+                    message_log.info("Edited reply %s: %s", sent.message.id, toSend)
+                    processed.content = toSend
                 else:
-                    am_pm = 0
-            logging.debug("am_pm guess: {}".format(am_pm))
-
-        # Formatting
-        if len(toSend) is not 0:
-            toSend += "\n"
-        toSend += "**"
-
-        # Print and conversion block
-        # Convert current time to 24 hour based on am/pm
-        if am_pm == 1 and hour != 12:
-            hour += 12
-        elif am_pm == 0 and hour == 12:
-            hour = 0
-
-        # Create localized DT for the sender (date is irrelevant... theoretically)
-        sender_DT = sender_TZ.localize(datetime.datetime(2020, 12, 20, hour, minute))
-
-        # Loop through all registered timezones for this guild, append to outgoing message
-        for zone in guilds[str(message.guild.id)]["timezones"]:
-            updatedTime = sender_DT.astimezone(pytz.timezone(zone))
-            toSend += "{}: {}   ".format(zone, updatedTime.strftime("%I:%M%p").lower())
-        toSend += '**'
+                    edits.edit_counters["deleted"] += 1
+                    message_log.info("Removed reply from %s, the edited message has no times", sent.message.id)
+                    processed.reply = processed.content = None
+                return
+            # The reply is shared with an identical one, too long to merge or was deleted, send a new one
+            processed.reply = processed.content = None
+        except discord.HTTPException:
+            logging.exception("Failed to update reply %s in channel %s", sent.message.id, after.channel.id)
+            return
 
     if len(toSend) != 0:
-        logging.info("Processing complete, sending message: " + toSend)
-        await message.channel.send(toSend)
-    else:
-        logging.info("No times detected")
+        logging.info("Processing edited message, sending message: %s", toSend)
+        processed.reply = await outbox.send(after.channel, toSend)
+        processed.content = toSend
+        edits.edit_counters["sent"] += 1
+
+
+# Awaits function(*args) once the messages ahead of it in the channel are done, see offload.takePlace
+async def inLine(channelID, function, *args):
+    previous, done = offload.takePlace(channelID)
+    try:
+        await previous
+        await function(*args)
+    finally:
+        offload.leave(channelID, None, done)
 
 # Bot commands -----------------------------------------------------------------------------
 class Timezones(commands.Cog):
@@ -310,86 +374,137 @@ class Timezones(commands.Cog):
         authorID = str(ctx.message.author.id)
         guildID = str(ctx.guild.id)
 
-        # Check if a record exists for this user, if not create one
-        if str(authorID) not in guilds[guildID]["users"]:
-            createInactiveRecord(authorID, guildID)
+        # Users without a record are ignored once welcomed, they don't need one to opt out
+        user = guilds.getUser(guildID, authorID)
+        if user is None:
+            welcome.markWelcomed(guildID, authorID)
 
-        logging.info("Active status for {} set to False".format(authorID))
+        logging.info("Active status for %s set to False", authorID)
         
         # Check for ricky bobby
         if str(authorID) != "324353466485178368":
-            guilds[guildID]["users"][str(authorID)]["active"] = False
+            if user is not None:
+                guilds.setActive(guildID, authorID, False)
         else:
             await ctx.message.add_reaction('\U0001F44E')
             return
         
 
-        # Update guilds -- Don't need to update on an opt_out since it doesn't change anything
-        #updateGuilds(guildID)
-
         #await ctx.send("You have been opted-out of automatic timezone conversion.")
         await ctx.message.add_reaction('\U0001F44D')
 
     @commands.command(name="opt_in", help="Opt-in to automatic timezone conversion")
     async def opt_in(self, ctx):
-        # Check if a record exists for this user, if not, the user should use set_tz
+        # Check if this user has set a timezone, if not, the user should use set_tz
         authorID = str(ctx.message.author.id)
         guildID = str(ctx.guild.id)
-        if str(authorID) not in guilds[guildID]["users"]:
+        user = guilds.getUser(guildID, authorID)
+        if user is None or user[0] is None:
             await ctx.send('Because you have not set your timezone before, please use -timezone to opt-in')
             return
 
-        logging.info("Active status for {} set to True".format(authorID))
-        guilds[guildID]["users"][str(authorID)]["active"] = True
-
-        # Update guilds
-        updateGuilds(guildID)
+        logging.info("Active status for %s set to True", authorID)
+        guilds.setActive(guildID, authorID, True)
 
         #await ctx.send('You have been opted-in to automatic timezone conversion!')
         await ctx.message.add_reaction('\U0001F44D')
 
 
-    @commands.command(name="timezone", help="east/est, central/cst, mountain/mt, pacific/pst", pass_context=True)
+    @commands.command(name="timezone", help="A city, abbreviation, zone or offset: berlin, est, Europe/Berlin, utc+5:30",
+                      pass_context=True)
     async def set_timezone(self, ctx, *, args):
         authorID = str(ctx.message.author.id)
         guildID = str(ctx.guild.id)
         args = args.lower()
 
-        # Decode timezone
-        if args == 'est' or args == 'east':
-            zone = 'US/Eastern'
-        elif args == 'cst' or args == 'central':
-            zone = 'US/Central'
-        elif args == 'mst' or args == 'mountain':
-            zone = 'US/Mountain'
-        elif args == 'pst' or args == 'pacific':
-            zone = 'US/Pacific'
-        elif "hammer" in args:
+        # Decode timezone, a zone name, abbreviation, city or UTC offset, see resolver.py
+        if "hammer" in args:
             await ctx.send("Stop, Hammer Time!")
             return
-        else:
+        zone, suggestions = resolver.resolve(args)
+        if zone is None:
             # Notify the user the requested timezone is invalid
-            logging.info("Could not resolve timezone: {}".format(args))
-            await ctx.send('Error: {} is not a valid timezone'.format(args))
+            logging.info("Could not resolve timezone: %s", args)
+            if len(suggestions) != 0:
+                await ctx.send('Error: {} is not a valid timezone, did you mean {}?'.format(args, ", ".join(suggestions)))
+            else:
+                await ctx.send('Error: {} is not a valid timezone'.format(args))
             return
 
-        # Check if a record already exists for this user, otherwise create a new one
-        if str(authorID) in guilds[guildID]["users"]:
-            guilds[guildID]["users"][authorID]["timezone"] = zone
-            guilds[guildID]["users"][authorID]["active"] = True
-            #await ctx.send('Your timezone has been updated to {}'.format(zone))
-            await ctx.message.add_reaction('\U0001F44D')
-        else:
-            guilds[guildID]["users"][str(authorID)] = {}
-            guilds[guildID]["users"][authorID]["timezone"] = zone
-            guilds[guildID]["users"][authorID]["active"] = True
-            #await ctx.send('Your timezone has been saved as {}'.format(zone))
-            await ctx.message.add_reaction('\U0001F44D')
+        # Creates a new record for this user or updates the existing one
+        guilds.setTimezone(guildID, authorID, zone)
+        #await ctx.send('Your timezone has been saved as {}'.format(zone))
+        await ctx.message.add_reaction('\U0001F44D')
+
+        logging.info("Timezone for %s has been saved as %s", authorID, zone)
+
+
+class Words(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.group(name="words", help="Show the word lists used to detect times in this guild", invoke_without_command=True)
+    async def words(self, ctx):
+        changes = guilds.getWords(str(ctx.guild.id)) or {}
+        lines = []
+        for name, words in zip(detection.WORD_LISTS, guildWords(str(ctx.guild.id))):
+            change = changes.get(name, {})
+            line = "{}: {}".format(name, ", ".join(sorted(word if word != "" else "''" for word in words)))
+            if len(change.get("add", [])) != 0 or len(change.get("remove", [])) != 0:
+                line += "  (added: {}, removed: {})".format(", ".join(change.get("add", [])) or "-",
+                                                          ", ".join(change.get("remove", [])) or "-")
+            lines.append(line)
+        await ctx.send("```\n{}\n```".format("\n".join(lines))[:2000])
+
+    @words.command(name="add", ignore_extra=False,
+                   help="Add a word to a list: before_positive, after_positive, before_negative, after_negative")
+    @commands.has_guild_permissions(manage_guild=True)
+    async def add(self, ctx, name, word):
+        await self.editWords(ctx, name, word, True)
+
+    @words.command(name="remove", ignore_extra=False, help="Remove a word from a list, including the default words")
+    @commands.has_guild_permissions(manage_guild=True)
+    async def remove(self, ctx, name, word):
+        await self.editWords(ctx, name, word, False)
+
+    @words.command(name="reset", help="Go back to the default word lists")
+    @commands.has_guild_permissions(manage_guild=True)
+    async def reset(self, ctx):
+        guildID = str(ctx.guild.id)
+        guilds.setWords(guildID, None)
+        detection.word_cache.pop(guildID, None)
+        logging.info("Word lists reset for guild %s", guildID)
+        await ctx.message.add_reaction('\U0001F44D')
+
+    async def editWords(self, ctx, name, word, add):
+        guildID = str(ctx.guild.id)
+        name = name.lower()
+        word = word.lower()
+        if name not in detection.WORD_LISTS:
+            await ctx.send('Error: {} is not a word list, use one of {}'.format(name, ", ".join(detection.WORD_LISTS)))
+            return
+        # The scanner only sees single words and single symbols around a number
+        if not re.fullmatch(r"[a-z0-9_]+|[^\sa-z0-9_]", word):
+            await ctx.send('Error: {} is not a single word or symbol'.format(word))
+            return
+
+        changes = detection.editWords(guilds.getWords(guildID), name, word, add)
+        if len(changes.get(name, {}).get("add", [])) > WORD_LIST_LIMIT:
+            await ctx.send('Error: {} already has {} added words'.format(name, WORD_LIST_LIMIT))
+            return
 
-        logging.info("Timezone for {} has been saved as {}".format(authorID, zone))
+        guilds.setWords(guildID, changes)
+        detection.word_cache.pop(guildID, None)
+        logging.info("Word %s %s %s for guild %s", word, "added to" if add else "removed from", name, guildID)
+        await ctx.message.add_reaction('\U0001F44D')
 
-        # Update guilds
-        updateGuilds(guildID)
+    async def cog_command_error(self, ctx, error):
+        if isinstance(error, commands.MissingPermissions):
+            await ctx.send('Error: changing the word lists requires the Manage Server permission')
+        elif isinstance(error, commands.UserInputError):
+            await ctx.send('Usage: -words add|remove <list> <word>, -words reset')
+        else:
+            logging.error("Error in a words command", exc_info=error)
 
 
 class Other(commands.Cog):
@@ -401,75 +516,176 @@ class Other(commands.Cog):
         logging.info("Bot responding to ping (test)")
         await ctx.send('pong! Bot is alive')
 
+    @commands.command(name='stats', help="Pipeline timings and counters, requires developer privileges")
+    async def stats(self, ctx):
+        if str(ctx.message.author.id) == DEVELOPER_ID:
+            await ctx.send("```\n{}\n```".format(metrics.formatStats()))
+        else:
+            logging.info("Unauthorized stats command attempted by user: %s with name: %s on guild: %s with name: %s",
+                         ctx.message.author.id, ctx.message.author.name, ctx.guild.id, ctx.guild.name)
+
+    @commands.command(name='profile', help="Profile cpu, memory or both for N seconds, requires developer privileges")
+    async def profile(self, ctx, seconds: int = 30, mode="both"):
+        if str(ctx.message.author.id) == DEVELOPER_ID:
+            mode = mode.lower()
+            if mode not in ("cpu", "memory", "both"):
+                await ctx.send('Usage: -profile <seconds> cpu|memory|both')
+                return
+            if profiler.running:
+                await ctx.send('A profile is already running')
+                return
+
+            seconds = max(1, min(seconds, profiler.PROFILE_MAX_SECONDS))
+            # Taken before the first await, a second -profile arriving meanwhile must see it
+            profiler.running = True
+            try:
+                await ctx.message.add_reaction('\U0001F44D')
+                summary = await profiler.capture(seconds, cpu=mode != "memory", memory=mode != "cpu")
+            finally:
+                profiler.running = False
+            await ctx.send("```\n{}\n```".format(summary[:1990]))
+        else:
+            logging.info("Unauthorized profile command attempted by user: %s with name: %s on guild: %s with name: %s",
+                         ctx.message.author.id, ctx.message.author.name, ctx.guild.id, ctx.guild.name)
+
     @commands.command(name='stop', help="Kills the bot, requires developer privileges")
     async def stop(self, ctx):
-        if str(ctx.message.author.id) == "192872910103248897":
+        if str(ctx.message.author.id) == DEVELOPER_ID:
             logging.info("Stop command received from authorized user, shutting down")
-            saveGuilds()
-            exit(1)
+            await guilds.flush()
+            await welcome.flush()
+            await self.bot.close()
         else:
-            logging.info("Unauthorized stop command attempted by user: {} with name: {} on guild: {} with name: {}".format(ctx.message.author.id, ctx.message.author.name, ctx.guild.id, ctx.guild.name))
+            logging.info("Unauthorized stop command attempted by user: %s with name: %s on guild: %s with name: %s",
+                         ctx.message.author.id, ctx.message.author.name, ctx.guild.id, ctx.guild.name)
 
 
 # Register cogs
 bot.add_cog(Timezones(bot))
+bot.add_cog(Words(bot))
 bot.add_cog(Other(bot))
 
 
 # Miscellaneous functions --------------------------------------------------------------------------
-# Updates guilds and saves the updated guild to a file
-def updateGuilds(guildID):
+# Loads guilds from the storage backend, called once before connecting
+# guilds.json is only split into guilds here, each guild is decoded when it is first used
+def loadGuilds():
     global guilds
-    guildID = str(guildID)
-
-    # Loop through all timezones registered for a guild, find all unique zones
-    timezones = []
-    for userID in guilds[guildID]["users"]:
-        if guilds[guildID]["users"][userID]["timezone"] not in timezones:
-            if guilds[guildID]["users"][userID]["timezone"] is not None:
-                timezones.append(guilds[guildID]["users"][userID]["timezone"])
+    start = time.perf_counter()
+    try:
+        if SHARD_COUNT is not None and STORAGE_BACKEND != "sqlite":
+            raise ValueError("Worker processes need the sqlite backend, {} can't be shared".format(STORAGE_BACKEND))
+        guilds = storage.openStorage(STORAGE_BACKEND)
+        guilds.load()
+        welcome.load()
+
+        # Cached conversion lines for a guild's old timezone list are no longer needed
+        guilds.timezonesChanged = lambda guildID, previous: conversion.invalidateZones(previous)
+    except:
+        logging.exception("An error occurred while loading guilds from the %s backend", STORAGE_BACKEND)
+        logging.critical("This program will now terminate")
+        exit(EXIT_LOAD_FAILED)
 
-    guilds[guildID]["timezones"] = timezones
-    saveGuilds()
+    # Check json version
+    if not guilds.version() == VERSION:
+        logging.warning("guilds version is %s, RealTimeBot.py version is %s, errors may occur", guilds.version(), VERSION)
 
+    # Build the DST transition tables for the zones -timezone can set, others are built on first use
+    tztables.buildTables(["US/Eastern", "US/Central", "US/Mountain", "US/Pacific"])
 
-# Save guilds to guilds.json
-def saveGuilds():
-    file = open('guilds.json', 'w+')
-    json.dump(guilds, file)
-    file.close()
+    # Workers are forked here, after the tables are built and before the event loop and its threads start
+    if OFFLOAD:
+        offload.start(["US/Eastern", "US/Central", "US/Mountain", "US/Pacific"])
+    logging.info("Loaded guilds from the %s backend in %.3f seconds", STORAGE_BACKEND, time.perf_counter() - start)
 
 
 # Used in on_message handler to verify a user is active, returns status code 0, 1, or 2
-# 0 = user not registered in database, 1 = user inactive, 2 = user active
+# 0 = user not registered and not welcomed yet, 1 = user inactive or welcomed without a record, 2 = user active
+# authorID is passed as the int Discord provides, the json backend keys users by int
 def checkUser(authorID, guildID):
     guildID = str(guildID)
-    authorID = str(authorID)
 
     # Check if this user has a record for this guild
-    if authorID not in guilds[guildID]["users"]:
-        # No record exists, create an inactive record and return 0
-        createInactiveRecord(authorID, guildID)
+    user = guilds.getUser(guildID, authorID)
+    if user is None:
+        # Users get no record until they set a timezone, welcome.welcomed remembers who was welcomed
+        if welcome.isWelcomed(guildID, authorID):
+            return 1
         return 0
-    elif not guilds[guildID]["users"][authorID]["active"]:
+    elif not user[1]:
+        # Records without a timezone expire once unseen for storage.INACTIVE_TTL days
+        if user[0] is None:
+            guilds.touchUser(guildID, authorID, storage.today())
         return 1
-    elif guilds[guildID]["users"][authorID]["active"]:
+    elif user[1]:
         return 2
     else:
         logging.error("checkUser() has failed to satisfy an if statement")
         return -1
 
 
-# Creates an inactive user record
-def createInactiveRecord(userID, guildID):
-    global guilds
-    logging.info("Creating user record for {}".format(userID))
-    guilds[guildID]["users"][str(userID)] = {}
-    guilds[guildID]["users"][str(userID)]["timezone"] = None
-    guilds[guildID]["users"][str(userID)]["active"] = False
+# Parses and converts the matches of a message sent by an opted in user, returns the reply or "" if there are no times
+def convertMatches(message, matches, guildID):
+    detections = detection.detectMatches(matches, guilds.getUser(guildID, message.author.id)[0],
+                                         guilds.getTimezones(guildID), message.created_at.replace(tzinfo=datetime.timezone.utc),
+                                         guildWords(guildID))
+    return detection.formatReply(detections)
+
+
+# Returns the compiled word lists of a guild, built from its changes on first use and cached in detection.word_cache
+def guildWords(guildID):
+    words = detection.word_cache.get(guildID)
+    if words is None:
+        words = detection.word_cache[guildID] = detection.compileWords(guilds.getWords(guildID))
+    return words
 
-    updateGuilds(guildID)
 
+# Fields of the health report from the bot itself, called from the health endpoint's thread
+def healthStatus():
+    latency = bot.latency
+    return {"connected": bot.is_ready() and not bot.is_closed() and math.isfinite(latency), "gateway_latency": latency,
+            "guilds": len(bot.guilds), "last_save": guilds.last_save, "pressure_level": admission.level}
 
-# Run the bot
-bot.run(TOKEN)
+
+# Background task, removes stale records every COMPACT_INTERVAL seconds
+async def compactLoop():
+    while True:
+        await asyncio.sleep(COMPACT_INTERVAL)
+        try:
+            await compactGuilds()
+        except Exception:
+            logging.exception("An error occurred while compacting guilds")
+
+
+# Removes the inactive records without a timezone which weren't seen for storage.INACTIVE_TTL days in the guilds this
+# process is connected to, their users are marked welcomed so they aren't welcomed again
+async def compactGuilds():
+    start = time.perf_counter()
+    day = storage.today()
+    records = reclaimed = 0
+    for guild in list(bot.guilds):
+        guildID = str(guild.id)
+        if not guilds.hasGuild(guildID):
+            continue
+        for userID in guilds.compactGuild(guildID, day - storage.INACTIVE_TTL, day):
+            welcome.markWelcomed(guildID, userID)
+            records += 1
+            reclaimed += storage.recordBytes(userID)
+        # Let messages in between guilds
+        await asyncio.sleep(0)
+
+    metrics.counters["compacted_records"] += records
+    metrics.counters["compacted_bytes"] += reclaimed
+    logging.info("Compaction removed %s records (%s bytes) from %s guilds in %.2f seconds", records, reclaimed,
+                 len(bot.guilds), time.perf_counter() - start)
+
+
+# Load guilds, run the bot, then write anything the background task hasn't
+if __name__ == "__main__":
+    loadGuilds()
+    bot.run(TOKEN)
+    if guilds is not None:
+        guilds.flushNow()
+    welcome.flushNow()
+    offload.stop()
+    logqueue.stop()
@@ -0,0 +1,92 @@
+import time
+import logging
+import datetime
+import health
+import metrics
+import outbox
+
+# Admission control, sheds low priority work while the bot is behind instead of trying to process everything
+# Pressure comes from the event loop lag (health.py) and the replies waiting in the outbox (outbox.py). Each level
+# sheds everything the levels below it shed:
+# 1: welcome prompts are skipped, the user isn't marked welcomed so a later message welcomes them
+# 2: messages older than SHED_MESSAGE_AGE seconds are dropped before they are scanned
+# 3: commands other than ESSENTIAL_COMMANDS are dropped
+
+# Settings -------------------------------------------------------------------------
+PRESSURE_LAG = [0.1, 0.5, 2.0]  # Seconds of event loop lag at which each level starts
+PRESSURE_BACKLOG = [200, 1000, 5000]  # Replies waiting in the outbox at which each level starts
+PRESSURE_INTERVAL = 0.25  # Seconds between pressure updates, messages in between use the last level
+PRESSURE_COOLDOWN = 5.0  # Seconds the pressure has to stay below the level before it drops by one
+SHED_MESSAGE_AGE = 30  # Seconds a message can be old before it is dropped at level 2
+ESSENTIAL_COMMANDS = {"timezone", "opt_in", "opt_out", "stats", "profile", "stop"}  # Served at every level
+
+# Admission Setup ------------------------------------------------------------------
+level = 0
+updated = 0.0  # Monotonic time of the last update
+calm_since = 0.0  # Monotonic time the pressure was last at or above level
+
+
+# Admission functions --------------------------------------------------------------
+# Level the lag and backlog call for, without the cooldown
+def pressure(lag, backlog):
+    target = 0
+    for index in range(len(PRESSURE_LAG)):
+        if lag >= PRESSURE_LAG[index] or backlog >= PRESSURE_BACKLOG[index]:
+            target = index + 1
+    return target
+
+
+# Current level, updated at most once every PRESSURE_INTERVAL seconds, rises at once and drops one level per cooldown
+def currentLevel():
+    global level, updated, calm_since
+    now = time.monotonic()
+    if now - updated < PRESSURE_INTERVAL:
+        return level
+    updated = now
+
+    lag = health.last_lag
+    backlog = outbox.backlog()
+    target = pressure(lag, backlog)
+    if target >= level:
+        if target > level:
+            logging.warning("Shedding load at level %s, event loop lag %.3f seconds, outbox backlog %s", target, lag, backlog)
+        level = target
+        calm_since = now
+    elif now - calm_since >= PRESSURE_COOLDOWN:
+        level -= 1
+        calm_since = now
+        logging.info("Load shedding down to level %s", level)
+    return level
+
+
+# True when a welcome prompt should be skipped
+def shedWelcome():
+    if currentLevel() < 1:
+        return False
+    metrics.counters["shed_welcomes"] += 1
+    return True
+
+
+# True when a message created at created_at, naive UTC as discord.py provides it, is too old to be worth converting
+def shedMessage(created_at):
+    if currentLevel() < 2:
+        return False
+    age = time.time() - created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+    if age <= SHED_MESSAGE_AGE:
+        return False
+    metrics.counters["shed_messages"] += 1
+    return True
+
+
+# True when the command in content, prefix included, should be dropped
+def shedCommand(content, prefix):
+    if currentLevel() < 3:
+        return False
+    words = content[len(prefix):].split(maxsplit=1)
+    if len(words) != 0 and words[0] in ESSENTIAL_COMMANDS:
+        return False
+    metrics.counters["shed_commands"] += 1
+    return True
+
+
+metrics.gauges["pressure_level"] = lambda: level
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+# Allow importing the conversion functions from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import tztables
+import conversion
+
+# Benchmark for converting many times into many zones, compares the pytz path (computeConversion),
+# the cached table path the bot uses (convertTime) and the NumPy batch API (convertBatch)
+# Every result is checked against pytz, including times within a day of DST transitions
+
+zones = ["US/Eastern", "US/Central", "US/Mountain", "US/Pacific", "Europe/London", "Europe/Berlin", "Asia/Kolkata",
+         "Australia/Sydney", "Pacific/Auckland", "America/St_Johns", "Asia/Tokyo", "America/Sao_Paulo"]
+
+
+# Random message times over the table range, a quarter of them within a day of one of the sender's transitions
+def buildTimes(count, sender, rng):
+    starts = [start for start in tztables.zone_tables[sender][0][1:] if start < tztables.table_end - 86400 * 2]
+    minutes = []
+    timestamps = []
+    for _ in range(count):
+        minutes.append(rng.randrange(1440))
+        if len(starts) != 0 and rng.random() < 0.25:
+            timestamps.append(rng.choice(starts) + rng.randrange(-86400, 86400))
+        else:
+            timestamps.append(rng.randrange(tztables.table_start + 86400 * 2, tztables.table_end - 86400 * 2))
+    return minutes, timestamps
+
+
+def runPytz(minutes, timestamps, sender, guildZones):
+    return [conversion.computeConversion(minute // 60, minute % 60, sender, guildZones, timestamp)[0]
+            for minute, timestamp in zip(minutes, timestamps)]
+
+
+def runTables(minutes, timestamps, sender, guildZones):
+    return [conversion.convertTime(minute // 60, minute % 60, sender, guildZones, timestamp)[0]
+            for minute, timestamp in zip(minutes, timestamps)]
+
+
+def runBatch(minutes, timestamps, sender, guildZones):
+    return conversion.convertBatch(minutes, sender, guildZones, timestamps)
+
+
+# Formats the batch walls the way the scalar paths do
+def formatBatch(walls, guildZones):
+    return [tuple((zone, conversion.formatTime(int(wall) // 60, int(wall) % 60)) for zone, wall in zip(guildZones, row))
+            for row in walls]
+
+
+def timeRun(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the NumPy batch conversion against pytz")
+    parser.add_argument("--times", type=int, default=20000, help="Sender times converted by each method")
+    parser.add_argument("--zones", type=int, default=len(zones), help="Guild zones each time is converted into")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if conversion.numpy is None:
+        sys.exit("numpy is not installed")
+    rng = random.Random(args.seed)
+    guildZones = (zones * (args.zones // len(zones) + 1))[:args.zones]
+    tztables.buildTables(zones)
+
+    print("{} times x {} zones".format(args.times, len(guildZones)))
+    print("{:<20} {:>10} {:>10} {:>12}".format("sender", "pytz", "tables", "batch"))
+    mismatches = 0
+    for sender in zones[:4] + ["Australia/Sydney", "America/St_Johns"]:
+        minutes, timestamps = buildTimes(args.times, sender, rng)
+        pytzTime, expected = timeRun(runPytz, minutes, timestamps, sender, guildZones)
+        conversion.conversion_cache.clear()
+        tablesTime, tables = timeRun(runTables, minutes, timestamps, sender, guildZones)
+        runBatch(minutes[:10], timestamps[:10], sender, guildZones)  # Builds the arrays
+        batchTime, (instants, walls) = timeRun(runBatch, minutes, timestamps, sender, guildZones)
+
+        batch = formatBatch(walls, guildZones)
+        for index in range(args.times):
+            if tables[index] != expected[index] or batch[index] != expected[index]:
+                mismatches += 1
+                if mismatches <= 10:
+                    print("mismatch: {} {} at {}: pytz {}, tables {}, batch {}".format(
+                        sender, conversion.formatTime(minutes[index] // 60, minutes[index] % 60), timestamps[index],
+                        expected[index], tables[index], batch[index]))
+        print("{:<20} {:>9.3f}s {:>9.3f}s {:>11.4f}s".format(sender, pytzTime, tablesTime, batchTime))
+
+    print("mismatches: {}".format(mismatches))
+    sys.exit(1 if mismatches != 0 else 0)
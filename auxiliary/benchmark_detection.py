@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import random
+import datetime
+import argparse
+
+# Allow importing the detection engine from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import detection
+import conversion
+
+# Micro-benchmark for the detection engine, runs detect() over a synthetic chat corpus
+# and reports messages/sec and p50/p99 latency per message
+
+# Message templates, {t} is replaced with a time and {n} with a plain number
+templates_time = ["I'll be on at {t}", "around {t} probably", "from {t} to {t}", "can we do {t}?",
+                  "meet by {t} tonight", "raid starts {t}pm", "ok {t}am works", "until {t} then I'm out",
+                  "{t} works for me", "game night at {t}, bring snacks"]
+templates_number = ["in {n} minutes", "that's like {n} percent", "got {n}k gold", "lvl {n} now",
+                    "{n} hours left", "I have {n} of them", "ping is {n}ms lol", "patch {n}.2 is out"]
+templates_plain = ["lol", "anyone up for a game?", "brb", "that was a great match", "gg", "who's online tonight",
+                   "i can't believe that happened", "did you see the new trailer", "nah I'm good",
+                   "let me check with everyone first and get back to you on that"]
+
+guild_zones = ["US/Central", "US/Eastern", "US/Mountain", "US/Pacific"]
+
+
+# Builds a deterministic corpus, the mix roughly follows a busy guild: mostly plain chat
+def buildCorpus(size, seed=0):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < 0.15:
+            hour = rng.randint(1, 12)
+            t = str(hour) if rng.random() < 0.6 else "{}:{:02d}".format(hour, rng.choice([0, 15, 30, 45]))
+            corpus.append(rng.choice(templates_time).replace("{t}", t))
+        elif roll < 0.30:
+            corpus.append(rng.choice(templates_number).replace("{n}", str(rng.randint(1, 500))))
+        else:
+            corpus.append(rng.choice(templates_plain))
+    return corpus
+
+
+# Returns the given percentile of a sorted list
+def percentile(values, pct):
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def run(corpus, repeat):
+    now = datetime.datetime.now(datetime.timezone.utc).replace(hour=18, minute=0, second=0, microsecond=0)
+    timings = []
+    detected = 0
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for message in corpus:
+            t0 = time.perf_counter()
+            detected += len(detection.detect(message, "US/Central", guild_zones, now))
+            timings.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+
+    timings.sort()
+    print("messages:      {}".format(len(timings)))
+    print("times found:   {}".format(detected))
+    print("messages/sec:  {:.0f}".format(len(timings) / total))
+    print("p50 (us):      {:.2f}".format(percentile(timings, 50) * 1e6))
+    print("p99 (us):      {:.2f}".format(percentile(timings, 99) * 1e6))
+
+    # Where the prefilter stopped each message
+    counters = detection.prefilter_counters
+    for stage in ("rejected_digit", "rejected_window", "rejected_scanner", "matched", "rejected_parser", "detected"):
+        print("{:<18}{} ({:.1f}%)".format(stage + ":", counters[stage], 100.0 * counters[stage] / counters["messages"]))
+
+    # Conversion cache effectiveness
+    stats = conversion.conversion_stats
+    lookups = max(1, stats["hits"] + stats["misses"])
+    print("cache hits:    {} ({:.1f}%)".format(stats["hits"], 100.0 * stats["hits"] / lookups))
+    print("cache misses:  {}".format(stats["misses"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the RealTimeBot detection engine")
+    parser.add_argument("--messages", type=int, default=10000, help="Size of the synthetic corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of passes over the corpus")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus generator")
+    args = parser.parse_args()
+
+    run(buildCorpus(args.messages, args.seed), args.repeat)
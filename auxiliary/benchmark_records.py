@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+# Allow importing the storage backends from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import storage
+
+# Benchmark for the memory held by user records in the json backend, measured with tracemalloc after building
+# the users of every guild from guilds.json text
+# dicts: the guilds.json layout kept as is, string user IDs --> {"timezone": ..., "active": ...}
+# slots: int user IDs --> a __slots__ record holding the zone string and active flag
+# packed: what JsonStorage keeps, int user IDs --> zone ID * 2 + active (storage.packUser)
+
+zones = ["US/Eastern", "US/Central", "US/Mountain", "US/Pacific", "Europe/London", "Europe/Berlin", "Asia/Kolkata"]
+
+
+class SlotsUser:
+    __slots__ = ("timezone", "active")
+
+    def __init__(self, timezone, active):
+        self.timezone = timezone
+        self.active = active
+
+
+# Guild sizes follow a long tail, returns the guilds as guilds.json text so zone strings aren't shared
+def buildGuilds(users, seed):
+    rng = random.Random(seed)
+    guilds = {}
+    guildID = 100000000000000000
+    userID = 200000000000000000
+    remaining = users
+    while remaining > 0:
+        guildID += rng.randint(1, 1000000)
+        members = {}
+        for _ in range(min(remaining, max(1, int(rng.paretovariate(1.2) * 20)))):
+            userID += rng.randint(1, 1000000)
+            active = rng.random() < 0.8
+            members[str(userID)] = {"timezone": rng.choice(zones) if active or rng.random() < 0.5 else None, "active": active}
+        remaining -= len(members)
+        guilds[str(guildID)] = {"timezones": [], "users": members}
+    return {guildID: json.dumps(guild) for guildID, guild in guilds.items()}
+
+
+def buildDicts(guild):
+    return guild["users"]
+
+
+def buildSlots(guild):
+    return {int(userID): SlotsUser(user["timezone"], user["active"]) for userID, user in guild["users"].items()}
+
+
+def buildPacked(guild):
+    return {int(userID): storage.packUser(user["timezone"], user["active"]) for userID, user in guild["users"].items()}
+
+
+# Returns (MB held by the users of every guild, seconds to decode and build them)
+# Each guild is decoded while tracing, only what build keeps is still held at the end, times include tracing
+def measure(build, guilds):
+    tracemalloc.start()
+    start = time.perf_counter()
+    users = [build(json.loads(text)) for text in guilds.values()]
+    elapsed = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del users
+    return held / 1048576, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the memory held by json backend user records")
+    parser.add_argument("--users", type=int, default=1000000, help="User records over every guild")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    guilds = buildGuilds(args.users, args.seed)
+    print("{} users in {} guilds".format(args.users, len(guilds)))
+    print("{:<10} {:>10} {:>12} {:>10}".format("layout", "memory", "per user", "build"))
+    for name, build in (("dicts", buildDicts), ("slots", buildSlots), ("packed", buildPacked)):
+        held, elapsed = measure(build, guilds)
+        print("{:<10} {:>8.1f}MB {:>10.0f}B {:>9.2f}s".format(name, held, held * 1048576 / args.users, elapsed))
@@ -0,0 +1,80 @@
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+# Allow importing the detection engine from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import detection
+
+# Scaling benchmark, compares the hand-written scanner against the regex it replaced over increasing message lengths
+# A linear matcher keeps a flat ns/char column as the length grows
+
+# The matcher used before the scanner, kept here for comparison only
+timeMatch_regex = re.compile("(\\b\\w*\\b)?\\s*([0-9]{1,2}:[0-9]{1,2}|[0-9]{1,4})\\s?([a-z]+|$|.?)?", re.IGNORECASE)
+timeMatch_removeDecimal = re.compile("[0-9]+\\.[0-9]+")
+
+
+def regexMatches(message_content):
+    message_content = message_content.lower()
+    message_content = re.sub(timeMatch_removeDecimal, '', message_content)
+    return re.findall(timeMatch_regex, message_content)
+
+
+def scannerMatches(message_content):
+    return detection.scanTimes(message_content.lower())
+
+
+# Pasted logs and spreadsheets: digits separated by runs of whitespace
+def buildLog(length, rng):
+    parts = []
+    size = 0
+    while size < length:
+        part = rng.choice(["{}".format(rng.randint(0, 99999)), " " * rng.randint(1, 40), "\t", "at",
+                           "{}:{:02d}".format(rng.randint(0, 23), rng.randint(0, 59)), "ok"])
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)[:length]
+
+
+# Worst case for the regex, long runs of word characters and whitespace in front of a digit
+def buildRuns(length, rng):
+    run = max(1, length // 8)
+    return ("a" * run + " " * run + "1 ") * (length // (2 * run + 2) + 1)
+
+
+def timeIt(function, message, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(message)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run(lengths, repeat):
+    rng = random.Random(0)
+    for name, builder in (("log", buildLog), ("runs", buildRuns)):
+        print("corpus: {}".format(name))
+        print("{:>10} {:>14} {:>14} {:>12} {:>12}".format("length", "regex (ms)", "scanner (ms)", "regex ns/ch", "scan ns/ch"))
+        for length in lengths:
+            message = builder(length, rng)[:length]
+            regexTime = timeIt(regexMatches, message, repeat)
+            scannerTime = timeIt(scannerMatches, message, repeat)
+            print("{:>10} {:>14.3f} {:>14.3f} {:>12.1f} {:>12.1f}".format(
+                length, regexTime * 1e3, scannerTime * 1e3, regexTime * 1e9 / length, scannerTime * 1e9 / length))
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare scanner and regex scaling over message length")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[100, 1000, 4000, 16000, 64000],
+                        help="Message lengths to benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="Best of N runs per length")
+    args = parser.parse_args()
+
+    run(args.lengths, args.repeat)
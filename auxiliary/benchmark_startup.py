@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import tempfile
+import subprocess
+
+# Allow importing the storage backends from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import storage
+
+# Benchmark for loading a large guilds.json at startup, each scenario runs in its own process so peak memory is comparable
+# legacy: json.load of a single line file and counting every guild's zones, what on_ready used to do on every connect
+# orjson: the same with orjson, legacy-lazy: JsonStorage.load on a single line file (full parse, zones counted on use)
+# lazy: JsonStorage.load on a file written one guild per line, guilds are only split out and decoded on use
+
+zones = ["US/Eastern", "US/Central", "US/Mountain", "US/Pacific"]
+
+
+# Guild sizes follow a long tail, a few large guilds and many small ones
+def buildState(targetBytes, seed):
+    rng = random.Random(seed)
+    data = {"version": "2.0"}
+    size = 0
+    guildID = 100000000000000000
+    userID = 200000000000000000
+    while size < targetBytes:
+        guildID += rng.randint(1, 1000000)
+        users = {}
+        for _ in range(int(rng.paretovariate(1.2) * 20)):
+            userID += rng.randint(1, 1000000)
+            active = rng.random() < 0.8
+            users[str(userID)] = {"timezone": rng.choice(zones) if active or rng.random() < 0.5 else None, "active": active}
+        data[str(guildID)] = {"timezones": [], "users": users}
+        size += 60 * len(users) + 60
+    return data
+
+
+def writeFiles(directory, targetBytes, seed):
+    data = buildState(targetBytes, seed)
+    legacy = os.path.join(directory, "legacy.json")
+    with open(legacy, 'w') as file:
+        json.dump(data, file)
+
+    lines = os.path.join(directory, "lines.json")
+    backend = storage.JsonStorage(lines)
+    backend.data = data
+    backend.writeFile(backend.serialize())
+    return legacy, lines, [guildID for guildID in data if guildID != "version"]
+
+
+# Runs in the child process, prints (load seconds, seconds to use the sampled guilds, peak RSS in MB)
+def runScenario(scenario, path, guildIDs):
+    start = time.perf_counter()
+    if scenario in ("legacy", "orjson"):
+        with open(path, 'rb') as file:
+            content = file.read()
+        data = json.loads(content) if scenario == "legacy" else storage.orjson.loads(content)
+        backend = storage.JsonStorage(path)
+        backend.data = data
+        for guildID in backend.guildIDs():
+            backend.guild(guildID)
+    else:
+        backend = storage.JsonStorage(path)
+        backend.load()
+    loaded = time.perf_counter()
+
+    for guildID in guildIDs:
+        backend.getTimezones(guildID)
+    used = time.perf_counter()
+
+    print(json.dumps([loaded - start, used - loaded, peakMemory()]))
+
+
+# Peak RSS in MB, ru_maxrss is carried over from the parent through fork so VmHWM is read where there is one
+def peakMemory():
+    try:
+        with open("/proc/self/status", 'r') as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark loading a large guilds.json")
+    parser.add_argument("--megabytes", type=int, default=100, help="Approximate size of the generated state file")
+    parser.add_argument("--active", type=float, default=1.0, help="Percent of guilds used after loading")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    parser.add_argument("--guilds", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario is not None:
+        with open(args.guilds, 'r') as file:
+            runScenario(args.scenario, args.file, json.load(file))
+        sys.exit(0)
+
+    directory = tempfile.mkdtemp()
+    legacy, lines, guildIDs = writeFiles(directory, args.megabytes * 1024 * 1024, args.seed)
+    sample = random.Random(args.seed).sample(guildIDs, max(1, int(len(guildIDs) * args.active / 100)))
+    sampleFile = os.path.join(directory, "sample.json")
+    with open(sampleFile, 'w') as file:
+        json.dump(sample, file)
+
+    print("state: {:.0f} MB single line, {:.0f} MB one guild per line, {} guilds, {} used after loading".format(
+        os.path.getsize(legacy) / 1048576, os.path.getsize(lines) / 1048576, len(guildIDs), len(sample)))
+    print("{:<12} {:>10} {:>12} {:>10}".format("scenario", "load", "first use", "peak RSS"))
+
+    scenarios = [("legacy", legacy), ("legacy-lazy", legacy), ("lazy", lines)]
+    if storage.orjson is not None:
+        scenarios.insert(1, ("orjson", legacy))
+    for scenario, path in scenarios:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--scenario", scenario, "--file", path,
+                                 "--guilds", sampleFile], capture_output=True, text=True, check=True).stdout
+        load, use, peak = json.loads(output)
+        print("{:<12} {:>9.3f}s {:>11.3f}s {:>8.0f}MB".format(scenario, load, use, peak))
+
+    for path in (legacy, lines, sampleFile):
+        os.remove(path)
+    os.rmdir(directory)
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+# Allow importing the storage backends from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import storage
+
+# Benchmark for guild timezone upkeep, compares the full rescan updateGuilds used to do on every change
+# with the refcounted zone sets in both storage backends, on a guild with many members
+
+zones = ["US/Eastern", "US/Central", "US/Mountain", "US/Pacific", "Europe/London", "Europe/Berlin", "Asia/Kolkata"]
+GUILD = "1"
+
+
+# The rescan updateGuilds did after every change, O(users x zones), over the json backend's packed records
+def rescanTimezones(guild):
+    timezones = []
+    for record in guild["users"].values():
+        timezone = storage.unpackUser(record)[0]
+        if timezone not in timezones:
+            if timezone is not None:
+                timezones.append(timezone)
+    guild["timezones"] = timezones
+
+
+# Random set_timezone, opt_in, opt_out and removed user changes
+def buildChanges(members, count, rng):
+    changes = []
+    for _ in range(count):
+        userID = str(rng.randrange(members * 2))
+        roll = rng.random()
+        if roll < 0.4:
+            changes.append(("setTimezone", userID, rng.choice(zones)))
+        elif roll < 0.7:
+            changes.append(("removeUser", userID, None))
+        else:
+            changes.append(("setActive", userID, roll < 0.85))
+    return changes
+
+
+def fillGuild(backend, members, rng):
+    backend.addGuild(GUILD)
+    for userID in range(members):
+        backend.setTimezone(GUILD, str(userID), rng.choice(zones))
+        if rng.random() < 0.3:
+            backend.setActive(GUILD, str(userID), False)
+
+
+def applyChanges(backend, changes, rescan):
+    start = time.perf_counter()
+    for name, userID, value in changes:
+        if name != "setTimezone" and backend.getUser(GUILD, userID) is None:
+            continue
+        if name == "removeUser":
+            backend.removeUser(GUILD, userID)
+        else:
+            getattr(backend, name)(GUILD, userID, value)
+        if rescan:
+            rescanTimezones(backend.data[GUILD])
+    return time.perf_counter() - start
+
+
+# Zones of active users, what the refcounts should always hold
+def expectedTimezones(backend, members):
+    expected = set()
+    for userID in range(members * 2):
+        user = backend.getUser(GUILD, str(userID))
+        if user is not None and user[1] and user[0] is not None:
+            expected.add(user[0])
+    return expected
+
+
+def run(members, count):
+    rng = random.Random(0)
+    changes = buildChanges(members, count, rng)
+
+    results = []
+    for name, backend, rescan in (("json + rescan", storage.JsonStorage(), True),
+                                  ("json refcount", storage.JsonStorage(), False),
+                                  ("sqlite refcount", storage.SqliteStorage(":memory:"), False)):
+        if isinstance(backend, storage.SqliteStorage):
+            backend.load()
+        fillGuild(backend, members, random.Random(1))
+        elapsed = applyChanges(backend, changes, rescan)
+        correct = set(backend.getTimezones(GUILD)) == expectedTimezones(backend, members)
+        results.append((name, elapsed, correct))
+
+    print("guild members: {}, changes: {}".format(members, count))
+    print("{:<18} {:>12} {:>14} {:>8}".format("backend", "total (ms)", "per change (us)", "correct"))
+    for name, elapsed, correct in results:
+        print("{:<18} {:>12.1f} {:>14.1f} {:>8}".format(name, elapsed * 1e3, elapsed * 1e6 / count, str(correct)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark guild timezone upkeep on large guilds")
+    parser.add_argument("--members", type=int, default=50000, help="Users in the benchmark guild")
+    parser.add_argument("--changes", type=int, default=2000, help="Number of preference changes to apply")
+    args = parser.parse_args()
+
+    run(args.members, args.changes)
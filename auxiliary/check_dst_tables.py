@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import datetime
+import argparse
+import zoneinfo
+
+# Allow importing the conversion modules from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import tztables
+import conversion
+
+# Checks the transition tables against pytz and zoneinfo around every DST transition in the table range
+# Exits with status 1 if any conversion or offset disagrees
+
+zones = ["US/Eastern", "US/Central", "US/Mountain", "US/Pacific", "US/Arizona", "Europe/London", "Europe/Berlin",
+         "Australia/Sydney", "Australia/Lord_Howe", "Asia/Kolkata", "Asia/Kathmandu", "America/Sao_Paulo",
+         "Pacific/Chatham", "America/St_Johns", "UTC", "Etc/GMT+5"]
+
+
+# Reference conversion, the sender's wall time on the sender's local date of the message, converted with pytz
+def referenceConversion(hour, minute, sender_tz, guild_zones, timestamp):
+    return conversion.computeConversion(hour, minute, sender_tz, guild_zones, timestamp)
+
+
+# Every table entry start in range, plus a few ordinary instants for zones without transitions
+def instantsToCheck(years):
+    instants = set()
+    for zone in zones:
+        for start in tztables.zone_tables[zone][0][1:]:
+            instants.add(start)
+    now = int(time.time())
+    instants.update(now + day * 86400 for day in range(0, 365, 30))
+    end = min(tztables.table_end - 86400, now + years * 366 * 86400)
+    return sorted(instant for instant in instants if tztables.table_start + 86400 < instant < end)
+
+
+def run(step, years):
+    tztables.buildTables(zones)
+    failures = 0
+    checked = 0
+
+    for instant in instantsToCheck(years):
+        # Messages sent in the two days around the transition, every step minutes of wall time
+        for timestamp in range(instant - 86400, instant + 86400, 3 * 3600):
+            for zone in zones:
+                expected = int(datetime.datetime.fromtimestamp(timestamp, zoneinfo.ZoneInfo(zone)).utcoffset().total_seconds())
+                if tztables.offsetAt(zone, timestamp) != expected:
+                    failures += 1
+                    print("offset mismatch {} at {}: {} != {}".format(zone, timestamp, tztables.offsetAt(zone, timestamp), expected))
+
+            for sender in zones:
+                for minuteOfDay in range(0, 1440, step):
+                    hour, minute = divmod(minuteOfDay, 60)
+                    actual = conversion.convertTime(hour, minute, sender, zones, timestamp)
+                    expected = referenceConversion(hour, minute, sender, zones, timestamp)
+                    checked += 1
+                    if actual != expected:
+                        failures += 1
+                        print("conversion mismatch {} {:02d}:{:02d} at {}:\n  {}\n  {}".format(
+                            sender, hour, minute, timestamp, actual[1], expected[1]))
+
+    print("checked {} conversions, {} failures".format(checked, failures))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the DST transition tables against pytz and zoneinfo")
+    parser.add_argument("--step", type=int, default=30, help="Minutes between checked wall times")
+    parser.add_argument("--years", type=int, default=1, help="Years of transitions to check, up to tztables.TABLE_YEARS")
+    args = parser.parse_args()
+
+    sys.exit(1 if run(args.step, args.years) else 0)
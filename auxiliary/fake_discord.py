@@ -0,0 +1,124 @@
+import copy
+import time
+import itertools
+import contextvars
+import discord
+from discord.ext import commands
+
+# Local stand-ins for the discord.py objects on_message and the cogs use, no connection to Discord is made
+# Every message sent through a FakeChannel is recorded along with the corpus line that caused it
+
+# Corpus line being handled, copied into the task discord.py creates for each dispatched event
+replay_index = contextvars.ContextVar("replay_index", default=None)
+
+# Snowflake style IDs for messages created by the fakes
+message_ids = itertools.count(1)
+
+
+class FakeUser:
+    def __init__(self, id, name, bot=False):
+        self.id = id
+        self.name = name
+        self.bot = bot
+        self.mention = "<@{}>".format(id)
+        self.guild_permissions = discord.Permissions.none()  # Checked by commands limited to guild managers
+
+
+class FakeGuild:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class FakeMessage:
+    def __init__(self, content, author, channel, created_at):
+        self.id = next(message_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.created_at = created_at  # Naive UTC, as discord.py 1.x provides it
+        self.reactions = []
+        self._state = None
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+        self.channel.gateway.record(self.channel, "reaction", emoji)
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+        self.channel.gateway.record(self.channel, "edit", content)
+
+    async def delete(self, **kwargs):
+        self.channel.gateway.record(self.channel, "delete", None)
+
+
+class FakeChannel:
+    def __init__(self, id, guild, gateway):
+        self.id = id
+        self.guild = guild
+        self.gateway = gateway
+
+    async def send(self, content=None, **kwargs):
+        self.gateway.record(self, "send", content)
+        return FakeMessage(content, self.gateway.user, self, None)
+
+
+# Context whose send goes through the fake channel instead of the HTTP client
+class FakeContext(commands.Context):
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+# Stand-in for the gateway connection, delivers messages to a bot and records everything the bot sends back
+class FakeGateway:
+    def __init__(self, bot):
+        self.bot = bot
+        self.user = FakeUser(0, "RealTimeBot", bot=True)
+        self.guilds = {}
+        self.channels = {}
+        self.delivered = {}  # Corpus line --> perf_counter time the message was delivered
+        self.events = []  # (corpus line, channel ID, kind, content, latency in seconds)
+
+        # The bot only needs its own user to skip its messages, and a context class that sends through the fakes
+        bot._connection.user = self.user
+        getContext = bot.get_context
+
+        async def get_context(message, *, cls=FakeContext):
+            return await getContext(message, cls=cls)
+        bot.get_context = get_context
+
+    def guild(self, guildID):
+        if guildID not in self.guilds:
+            self.guilds[guildID] = FakeGuild(guildID, "Guild {}".format(guildID))
+            self.channels[guildID] = FakeChannel(guildID, self.guilds[guildID], self)
+        return self.guilds[guildID]
+
+    # Dispatches a message the same way the gateway would, as its own on_message task
+    def deliver(self, index, guildID, author, content, created_at):
+        self.guild(guildID)
+        message = FakeMessage(content, author, self.channels[guildID], created_at)
+        self.delivered[index] = time.perf_counter()
+        token = replay_index.set(index)
+        try:
+            self.bot.dispatch("message", message)
+        finally:
+            replay_index.reset(token)
+        return message
+
+    # Edits a delivered message and dispatches on_message_edit with the message before and after
+    def deliverEdit(self, index, message, content):
+        before = copy.copy(message)
+        message.content = content
+        self.delivered[index] = time.perf_counter()
+        token = replay_index.set(index)
+        try:
+            self.bot.dispatch("message_edit", before, message)
+        finally:
+            replay_index.reset(token)
+        return message
+
+    def record(self, channel, kind, content):
+        index = replay_index.get()
+        latency = None if index is None else time.perf_counter() - self.delivered[index]
+        self.events.append((index, channel.id, kind, content, latency))
@@ -0,0 +1,21 @@
+import os
+import sys
+import argparse
+
+# Allow importing the storage backends from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import storage
+
+# One-shot import of an existing guilds.json (version 2.0) into the sqlite backend
+parser = argparse.ArgumentParser(description="Import guilds.json into guilds.db")
+parser.add_argument("source", nargs="?", default=storage.GUILDS_FILE, help="guilds.json to import")
+parser.add_argument("destination", nargs="?", default=storage.SQLITE_FILE, help="SQLite database to create or update")
+args = parser.parse_args()
+
+database = storage.SqliteStorage(args.destination)
+database.load()
+database.importJson(args.source)
+
+guildIDs = database.guildIDs()
+users = database.connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+print("Imported {} guilds and {} users from {} into {}".format(len(guildIDs), users, args.source, args.destination))
@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import difflib
+import argparse
+import datetime
+import tempfile
+
+# Allow importing the bot from the repository root and the benchmark corpus from this directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import RealTimeBot
+import storage
+import outbox
+import offload
+from fake_discord import FakeGateway, FakeUser
+from benchmark_detection import buildCorpus
+
+# Offline replay harness, feeds a JSONL corpus of messages through on_message and the cogs using a fake gateway
+# Corpus lines: {"guild": id, "author": id, "content": text, "timestamp": epoch seconds}, optionally "timezone"
+# to register the author first, or {"edit": index of an earlier line, "content": text} to edit that message.
+# Reports throughput, reply latency, event loop lag and a golden diff of every reply
+
+zones = ["US/Eastern", "US/Central", "US/Mountain", "US/Pacific"]
+commands_corpus = ["-timezone cst", "-timezone est", "-opt_out", "-opt_in", "-ping", "-timezone pacific"]
+
+
+# Synthetic corpus: chat from benchmark_detection spread over guilds and authors, with a few commands mixed in
+# editPercent of the lines edit one of the previous 50 messages, half of them only touching text outside the times
+def generateCorpus(size, guildCount, seed, startTime, editPercent=0):
+    rng = random.Random(seed)
+    editRng = random.Random(seed + 1)
+    lines = []
+    for index, content in enumerate(buildCorpus(size, seed)):
+        if rng.random() < 0.01:
+            content = rng.choice(commands_corpus)
+        line = {"guild": rng.randint(1, guildCount), "author": rng.randint(1, 500), "content": content,
+                "timestamp": startTime + index}
+        if index != 0 and editRng.random() * 100 < editPercent:
+            edited = editRng.randrange(max(0, index - 50), index)
+            while "edit" in lines[edited]:
+                edited = lines[edited]["edit"]
+            newContent = lines[edited]["content"] + " (edited)" if editRng.random() < 0.5 else content
+            line = {"edit": edited, "content": newContent}
+        lines.append(line)
+    return lines
+
+
+def loadCorpus(path):
+    with open(path, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+# Registers authors in the backend, authors without a "timezone" field get a zone picked from their ID,
+# except one in five which stay unregistered so the welcome path is exercised
+def prepareGuilds(backend, corpus, guildCount):
+    for line in corpus:
+        if "edit" in line:
+            continue
+        guildID = str(mapGuild(line["guild"], guildCount))
+        authorID = str(line["author"])
+        if not backend.hasGuild(guildID):
+            backend.addGuild(guildID)
+        if backend.getUser(guildID, authorID) is not None:
+            continue
+        zone = line.get("timezone")
+        if zone is None and int(line["author"]) % 5 != 0:
+            zone = zones[int(line["author"]) % len(zones)]
+        if zone is not None:
+            backend.setTimezone(guildID, authorID, zone)
+
+
+def mapGuild(guildID, guildCount):
+    if guildCount == 0:
+        return int(guildID)
+    return int(guildID) % guildCount + 1
+
+
+def percentile(values, pct):
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+# Measures how late the event loop wakes up a task which sleeps for interval seconds
+async def sampleLag(samples, interval=0.01):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def replay(corpus, guildCount, rate):
+    gateway = FakeGateway(RealTimeBot.bot)
+    authors = {}
+    messages = {}  # Corpus line --> delivered message, for edits
+    lag = []
+    sampler = asyncio.ensure_future(sampleLag(lag))
+
+    start = time.perf_counter()
+    for index, line in enumerate(corpus):
+        # Hold each message until its slot, a bot falling behind shows up as reply latency
+        if rate > 0:
+            delay = start + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif index % 100 == 0:
+            await asyncio.sleep(0)
+
+        if "edit" in line:
+            gateway.deliverEdit(index, messages[line["edit"]], line["content"])
+            continue
+        authorID = int(line["author"])
+        if authorID not in authors:
+            authors[authorID] = FakeUser(authorID, "user{}".format(authorID))
+        created_at = datetime.datetime.utcfromtimestamp(line["timestamp"])
+        messages[index] = gateway.deliver(index, mapGuild(line["guild"], guildCount), authors[authorID], line["content"], created_at)
+
+    # Let every dispatched on_message finish
+    while True:
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task() and task is not sampler]
+        if len(pending) == 0:
+            break
+        await asyncio.gather(*pending, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+
+    return gateway, elapsed, lag
+
+
+def report(corpus, gateway, elapsed, lag):
+    latencies = [event[4] for event in gateway.events if event[2] == "send" and event[4] is not None]
+    print("messages:          {}".format(len(corpus)))
+    print("replies:           {} ({} reactions, {} edited, {} deleted)".format(
+        len(latencies), *(sum(1 for event in gateway.events if event[2] == kind) for kind in ("reaction", "edit", "delete"))))
+    print("handled/sec:       {:.0f}".format(len(corpus) / elapsed))
+    print("reply latency ms:  p50 {:.2f}  p90 {:.2f}  p99 {:.2f}  max {:.2f}".format(
+        percentile(latencies, 50) * 1e3, percentile(latencies, 90) * 1e3, percentile(latencies, 99) * 1e3,
+        max(latencies, default=0) * 1e3))
+    print("event loop lag ms: p50 {:.2f}  p99 {:.2f}  max {:.2f}".format(
+        percentile(lag, 50) * 1e3, percentile(lag, 99) * 1e3, max(lag, default=0) * 1e3))
+    print("out of order:      {} replies sent before a reply to an earlier message in their channel".format(outOfOrder(gateway)))
+
+
+# Replies sent after a reply to a later message of the same channel, offloaded messages must keep this at 0
+def outOfOrder(gateway):
+    latest = {}
+    count = 0
+    for event in gateway.events:
+        if event[2] != "send" or event[0] is None:
+            continue
+        if event[0] < latest.get(event[1], -1):
+            count += 1
+        latest[event[1]] = max(event[0], latest.get(event[1], -1))
+    return count
+
+
+# One JSON line per reply in corpus order, what the golden diff compares
+def goldenLines(gateway):
+    events = sorted((event for event in gateway.events if event[0] is not None), key=lambda event: event[0])
+    return [json.dumps({"index": event[0], "channel": event[1], "kind": event[2], "content": event[3]}) for event in events]
+
+
+def compareBaseline(lines, path, limit=40):
+    with open(path, 'r') as file:
+        baseline = [line.rstrip("\n") for line in file]
+    diff = list(difflib.unified_diff(baseline, lines, fromfile=path, tofile="replay", lineterm=""))
+    if len(diff) == 0:
+        print("golden diff:       identical to {}".format(path))
+        return True
+    changed = sum(1 for line in diff if line[:1] in "+-" and line[:3] not in ("+++", "---"))
+    print("golden diff:       {} changed lines against {}".format(changed, path))
+    for line in diff[:limit]:
+        print("  " + line)
+    if len(diff) > limit:
+        print("  ... {} more lines".format(len(diff) - limit))
+    return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a message corpus through RealTimeBot without Discord")
+    parser.add_argument("corpus", nargs="?", help="JSONL corpus to replay, a synthetic one is generated if omitted")
+    parser.add_argument("--generate", type=int, default=5000, help="Size of the synthetic corpus")
+    parser.add_argument("--guilds", type=int, default=0, help="Spread the corpus over N simulated guilds, 0 keeps its guild IDs")
+    parser.add_argument("--rate", type=float, default=0, help="Messages per second, 0 replays as fast as possible")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic corpus")
+    parser.add_argument("--edits", type=float, default=0, help="Percent of synthetic lines which edit an earlier message")
+    parser.add_argument("--start-time", type=int, default=None,
+                        help="Epoch timestamp of the first synthetic message, defaults to 18:00 UTC today")
+    parser.add_argument("--state", help="guilds.json to start from instead of registering corpus authors")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="Keep the outbox rate limit and merge window, replies then depend on timing and won't match a baseline")
+    parser.add_argument("--offload", type=int, default=0,
+                        help="Parse every message in this many worker processes, see offload.py")
+    parser.add_argument("--record", help="Write the replies to this file, use it later as a baseline")
+    parser.add_argument("--baseline", help="Golden replies to diff against")
+    args = parser.parse_args()
+
+    if args.corpus is not None:
+        corpus = loadCorpus(args.corpus)
+    else:
+        startTime = args.start_time
+        if startTime is None:
+            today = datetime.datetime.now(datetime.timezone.utc).replace(hour=18, minute=0, second=0, microsecond=0)
+            startTime = int(today.timestamp())
+        corpus = generateCorpus(args.generate, args.guilds or 10, args.seed, startTime, args.edits)
+
+    # The bot works on a scratch copy so the replay never touches the real guilds file
+    backend = storage.JsonStorage(os.path.join(tempfile.mkdtemp(), "guilds.json"))
+    if args.state is not None:
+        backend.path = args.state
+        backend.load()
+        backend.path = os.path.join(tempfile.mkdtemp(), "guilds.json")
+    else:
+        backend.data = {"version": RealTimeBot.VERSION}
+    prepareGuilds(backend, corpus, args.guilds)
+    RealTimeBot.guilds = backend
+
+    # Without a rate limit or merge window every reply is sent on its own as soon as it is ready
+    if not args.coalesce:
+        outbox.CHANNEL_BURST = float("inf")
+        outbox.COALESCE_WINDOW = 0
+
+    if args.offload > 0:
+        offload.OFFLOAD_LENGTH = 0
+        offload.start(["US/Eastern", "US/Central", "US/Mountain", "US/Pacific"], args.offload)
+
+    gateway, elapsed, lag = RealTimeBot.bot.loop.run_until_complete(replay(corpus, args.guilds, args.rate))
+    report(corpus, gateway, elapsed, lag)
+    offload.stop()
+
+    lines = goldenLines(gateway)
+    if args.record is not None:
+        with open(args.record, 'w') as file:
+            file.write("\n".join(lines) + "\n")
+        print("recorded:          {} replies to {}".format(len(lines), args.record))
+    if args.baseline is not None and not compareBaseline(lines, args.baseline):
+        sys.exit(1)
@@ -1,2 +1,25 @@
 #!/bin/bash
-ps -aux | grep RealTimeBot.py
+
+# Asks each bot process for its health report, see health.py
+# RealTimeBot.py listens on port 8390, launcher.py workers on 8391 and up: PORTS="8391 8392" ./check_bot.sh
+PORTS=${PORTS:-8390}
+STATUS=0
+
+for PORT in $PORTS; do
+    # 200 is healthy, 503 means the event loop is blocked or the gateway is down, no answer means it isn't running
+    RESPONSE=$(curl -s --max-time 5 -w "\n%{http_code}" "http://127.0.0.1:$PORT/health")
+    CODE=$(echo "$RESPONSE" | tail -n 1)
+    echo "$RESPONSE" | head -n -1
+    if [ "$CODE" == "200" ]; then
+        echo "RealTimeBot on port $PORT is healthy"
+    elif [ "$CODE" == "503" ]; then
+        echo "RealTimeBot on port $PORT is unhealthy"
+        STATUS=1
+    else
+        echo "RealTimeBot on port $PORT is not responding"
+        ps -aux | grep "RealTimeBot.py\|launcher.py" | grep -v grep
+        STATUS=1
+    fi
+done
+
+exit $STATUS
@@ -0,0 +1,196 @@
+import datetime
+import pytz
+import logging
+import tztables
+from collections import OrderedDict
+
+# Only needed for convertBatch
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Settings -------------------------------------------------------------------------
+CONVERSION_CACHE_SIZE = 4096  # Maximum number of formatted conversion lines kept in memory
+
+# Conversion Cache Setup -------------------------------------------------------------------
+# Formatted conversion lines, least recently used first
+# Key: (sender zone, hour, minute, sender offset, DST period, guild zones), value: (conversions, line)
+conversion_cache = OrderedDict()
+cache_version = 0  # tztables.table_version the cached lines were built with
+conversion_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+# Conversion functions ---------------------------------------------------------------------
+# Converts a sender local 24 hour time on the local date of timestamp (UTC epoch seconds) into every zone in guild_zones
+# Returns (conversions, line), conversions is a tuple of (zone, formatted time) and line is the formatted reply line
+def convertTime(hour, minute, sender_tz, guild_zones, timestamp):
+    global cache_version
+
+    # Resolve the instant the sender means from the transition tables
+    for zone in guild_zones:
+        if zone not in tztables.zone_tables:
+            tztables.loadZone(zone)
+    senderOffset = tztables.offsetAt(sender_tz, timestamp)
+    instant = None
+    if senderOffset is not None:
+        local = (timestamp + senderOffset) // 86400 * 86400 + hour * 3600 + minute * 60
+        instant = tztables.localToUTC(sender_tz, local)
+    if instant is None:
+        logging.debug("Timestamp %s is outside the transition tables, converting with pytz", timestamp)
+        return computeConversion(hour, minute, sender_tz, guild_zones, timestamp)
+
+    # Loading a zone adds period bounds, lines cached before that may span a transition
+    if cache_version != tztables.table_version:
+        conversion_cache.clear()
+        cache_version = tztables.table_version
+
+    # Within one period every zone keeps its offset, so the line only depends on the offset the sender's time was read with
+    key = (sender_tz, hour, minute, local - instant, tztables.periodAt(instant), tuple(guild_zones))
+
+    cached = conversion_cache.get(key)
+    if cached is not None:
+        conversion_stats["hits"] += 1
+        conversion_cache.move_to_end(key)
+        return cached
+
+    conversion_stats["misses"] += 1
+    conversions = []
+    line = "**"
+    for zone in guild_zones:
+        wall = (instant + tztables.offsetAt(zone, instant)) % 86400
+        updatedTime = formatTime(wall // 3600, wall // 60 % 60)
+        conversions.append((zone, updatedTime))
+        line += "{}: {}   ".format(zone, updatedTime)
+    line += "**"
+
+    cached = (tuple(conversions), line)
+    conversion_cache[key] = cached
+    if len(conversion_cache) > CONVERSION_CACHE_SIZE:
+        conversion_cache.popitem(last=False)
+        conversion_stats["evictions"] += 1
+    return cached
+
+
+# Uncached pytz conversion, used outside the range of the transition tables, see convertTime
+def computeConversion(hour, minute, sender_tz, guild_zones, timestamp):
+    sender_TZ = pytz.timezone(sender_tz)
+    localDate = datetime.datetime.fromtimestamp(timestamp, pytz.utc).astimezone(sender_TZ)
+    sender_DT = sender_TZ.localize(datetime.datetime(localDate.year, localDate.month, localDate.day, hour, minute))
+
+    conversions = []
+    line = "**"
+    for zone in guild_zones:
+        updatedTime = sender_DT.astimezone(pytz.timezone(zone)).strftime("%I:%M%p").lower()
+        conversions.append((zone, updatedTime))
+        line += "{}: {}   ".format(zone, updatedTime)
+    line += "**"
+    return tuple(conversions), line
+
+
+# Formats a 24 hour time the same way as strftime("%I:%M%p").lower()
+def formatTime(hour, minute):
+    return "{:02d}:{:02d}{}".format(hour % 12 or 12, minute, "am" if hour < 12 else "pm")
+
+
+# Drops every cached line built for a guild timezone list, called when a guild's list changes
+def invalidateZones(guild_zones):
+    guild_zones = tuple(guild_zones)
+    stale = [key for key in conversion_cache if key[5] == guild_zones]
+    for key in stale:
+        del conversion_cache[key]
+
+    conversion_stats["invalidations"] += 1
+    logging.debug("Conversion cache invalidated %s lines for %s", len(stale), guild_zones)
+
+
+# Batch Conversion -------------------------------------------------------------------------
+# Transition tables as arrays, zone --> (starts, offsets, dsts), built from tztables.zone_tables on first use
+batch_tables = {}
+batch_version = 0  # tztables.table_version the arrays were built with
+
+
+# Converts many sender local times at once, for bulk work such as replaying history or rendering a day of times
+# minutes: sender local minutes of the day (0 to 1439), read on the sender's local date of timestamps
+# timestamps: UTC epoch seconds of each message, or one timestamp for every time
+# Returns (instants, walls), the UTC epoch seconds of each time and an array of shape (times, zones) holding
+# the wall minute of the day of each time in each of guild_zones, the same times convertTime formats
+def convertBatch(minutes, sender_tz, guild_zones, timestamps):
+    if numpy is None:
+        raise ImportError("convertBatch needs numpy")
+    minutes = numpy.asarray(minutes, dtype=numpy.int64)
+    timestamps = numpy.broadcast_to(numpy.asarray(timestamps, dtype=numpy.int64), minutes.shape)
+    # Loading a zone changes the table version, load them all before building any arrays
+    for zone in [sender_tz] + list(guild_zones):
+        if zone not in tztables.zone_tables:
+            tztables.loadZone(zone)
+
+    # The sender's local date, then the instant of each wall time on it
+    senderOffsets = offsetsAt(sender_tz, timestamps)[0]
+    local = (timestamps + senderOffsets) // 86400 * 86400 + minutes * 60
+    instants = localToUTCBatch(sender_tz, local)
+
+    walls = numpy.empty((len(minutes), len(guild_zones)), dtype=numpy.int64)
+    for column, zone in enumerate(guild_zones):
+        walls[:, column] = (instants + offsetsAt(zone, instants)[0]) % 86400 // 60
+
+    # Same range convertTime uses the tables for, anything outside is converted with pytz
+    outside = ((timestamps < tztables.table_start) | (timestamps >= tztables.table_end) |
+               (local - 86400 < tztables.table_start) | (local + 86400 >= tztables.table_end))
+    for row in numpy.nonzero(outside)[0]:
+        sender_TZ = pytz.timezone(sender_tz)
+        localDate = datetime.datetime.fromtimestamp(int(timestamps[row]), pytz.utc).astimezone(sender_TZ)
+        sender_DT = sender_TZ.localize(datetime.datetime(localDate.year, localDate.month, localDate.day,
+                                                         int(minutes[row]) // 60, int(minutes[row]) % 60))
+        instants[row] = int(sender_DT.timestamp())
+        for column, zone in enumerate(guild_zones):
+            wall = sender_DT.astimezone(pytz.timezone(zone))
+            walls[row, column] = wall.hour * 60 + wall.minute
+    return instants, walls
+
+
+# Returns the table arrays of a zone, loading the zone into tztables if needed
+def zoneArrays(zone):
+    global batch_version
+    if batch_version != tztables.table_version:
+        batch_tables.clear()
+        batch_version = tztables.table_version
+    arrays = batch_tables.get(zone)
+    if arrays is None:
+        if zone not in tztables.zone_tables:
+            tztables.loadZone(zone)
+        starts, offsets, dsts = tztables.zone_tables[zone]
+        arrays = (numpy.array(starts, dtype=numpy.int64), numpy.array(offsets, dtype=numpy.int64), numpy.array(dsts, dtype=bool))
+        batch_tables[zone] = arrays
+    return arrays
+
+
+# Returns (offsets, dsts) of zone at every timestamp, timestamps before the tables use the first entry
+def offsetsAt(zone, timestamps):
+    starts, offsets, dsts = zoneArrays(zone)
+    index = numpy.maximum(numpy.searchsorted(starts, timestamps, side="right") - 1, 0)
+    return offsets[index], dsts[index]
+
+
+# Array version of tztables.localToUTC, local is seconds since the epoch in the zone's local time
+# The offsets in force a day before and a day after are the only candidates, the same choice is made between them:
+# standard time for ambiguous times, and skipped times are resolved six hours earlier and stepped forward
+def localToUTCBatch(zone, local):
+    before, beforeDst = offsetsAt(zone, local - 86400)
+    after, afterDst = offsetsAt(zone, local + 86400)
+    first = local - before
+    second = local - after
+    firstValid = offsetsAt(zone, first)[0] == before
+    secondValid = offsetsAt(zone, second)[0] == after
+
+    instants = numpy.where(firstValid, first, second)
+    ambiguous = firstValid & secondValid & (first != second)
+    if ambiguous.any():
+        choice = numpy.where(beforeDst & ~afterDst, second,
+                             numpy.where(afterDst & ~beforeDst, first, numpy.minimum(first, second)))
+        instants = numpy.where(ambiguous, choice, instants)
+
+    skipped = ~firstValid & ~secondValid
+    if skipped.any():
+        instants[skipped] = localToUTCBatch(zone, local[skipped] - 21600) + 21600
+    return instants
@@ -0,0 +1,446 @@
+import re
+import string
+import time
+import logging
+from collections import namedtuple
+import conversion
+import tztables
+
+# Settings -------------------------------------------------------------------------
+SAFEMODE = True  # This should never be disabled, realistically speaking
+
+# Word List & Regex Setup -----------------------------------------------------------------
+# Default lists, guilds can add and remove words with the -words commands
+# Lists of words which may indicate a match
+words_before_positive = ["at", "around", "about", "for", "probably", "from", "by", "until"]
+words_after_positive = ["am", "pm", "to"]
+
+# Lists of words which may indicate the detection is not a match
+words_before_negative = ["in"]
+words_after_negative = ["minutes", "hours", "minute", "hour", "min", "mins", "days", "weeks", "months", "years", "percent", "%", "k",]
+
+# If SAFEMODE is disabled, add some riskier words
+if not SAFEMODE:
+    words_before_positive.extend(['', "like"])
+
+# Words which join two times into a range, the second time is always treated as a match ("from 8 to 9")
+words_range = ["to"]
+
+# Word lists a guild can change, compiled into frozensets so every lookup is O(1) however long the lists get
+WORD_LISTS = ["before_positive", "after_positive", "before_negative", "after_negative"]
+WordLists = namedtuple("WordLists", WORD_LISTS)
+default_words = WordLists(frozenset(words_before_positive), frozenset(words_after_positive),
+                          frozenset(words_before_negative), frozenset(words_after_negative))
+
+# Compiled lists of every guild seen, guild ID --> WordLists, a guild's entry is dropped when it edits its lists
+word_cache = {}
+
+# Per match events, sampled by logqueue.LOG_SAMPLING
+match_log = logging.getLogger("detection.match")
+
+# Scanner Setup ----------------------------------------------------------------------------
+# Only used to jump to the next digit, this pattern has nothing to backtrack over
+scanner_digit = re.compile("[0-9]")
+
+# Prefilter Setup --------------------------------------------------------------------------
+# Digit runs including decimals, grouped numbers and clock times, the separators keep this from backtracking
+prefilter_number = re.compile("[0-9]+(?:[.,:][0-9]+)*")
+PREFILTER_WINDOW = 24  # Characters of context kept on each side of a candidate number
+
+# Number of messages seen by findMatches and where each one stopped, the first four stages add up to messages
+# rejected_digit: no digit at all, rejected_window: no number shaped like a time,
+# rejected_scanner: candidates found but the scanner matched nothing, matched: at least one match
+# Matched messages which were also parsed, only those of opted in users in the bot, end in one of
+# rejected_parser: no time accepted, detected: at least one time accepted
+prefilter_counters = {"messages": 0, "rejected_digit": 0, "rejected_window": 0, "rejected_scanner": 0, "matched": 0,
+                      "rejected_parser": 0, "detected": 0}
+
+# Number of matches seen by parseMatches and why each rejected one was dropped
+# negative_before/negative_after: negative word found, safemode: no positive word, invalid: not a valid time
+match_counters = {"matches": 0, "negative_before": 0, "negative_after": 0, "safemode": 0, "invalid": 0, "accepted": 0}
+
+# A possible time found by the scanner
+# before: word directly preceding the number, number: digits with an optional colon,
+# after: word (or single symbol) directly following the number, range_end: second half of a range
+Match = namedtuple("Match", ["before", "number", "after", "range_end"])
+
+# Result of a single detected time
+# match: Match tuple the time was parsed from
+# hour/minute: 24 hour time local to the sender
+# conversions: tuple of (zone, formatted time) for every guild timezone
+# line: formatted line for the outgoing message
+Detection = namedtuple("Detection", ["match", "hour", "minute", "conversions", "line"])
+
+
+# Detection functions ----------------------------------------------------------------------
+# Detects times in a message and converts them for every zone in guild_zones
+# sender_tz is a timezone name, now is an aware datetime (defaults to the current time)
+# Returns a list of Detection tuples, empty if no times were found
+# words is the guild's WordLists, see compileWords
+def detect(message_text, sender_tz, guild_zones, now=None, words=default_words):
+    return detectMatches(findMatches(message_text), sender_tz, guild_zones, now, words)
+
+
+# Same as detect, for matches already returned by findMatches
+def detectMatches(matches, sender_tz, guild_zones, now=None, words=default_words):
+    if now is None:
+        timestamp = int(time.time())
+    else:
+        timestamp = int(now.timestamp())
+
+    detections = []
+    currentTime = None
+    for match, hour, minute, am_pm in parseMatches(matches, words):
+        # Grab the sender's local time once a time has been found
+        if currentTime is None:
+            currentTime = tztables.localTime(sender_tz, timestamp)
+
+        # If am_pm not specified by user, guess
+        if am_pm == -1 and hour < 13:
+            am_pm = guessAmPm(hour, minute, currentTime)
+
+        hour = to24Hour(hour, am_pm)
+        conversions, line = conversion.convertTime(hour, minute, sender_tz, guild_zones, timestamp)
+        detections.append(Detection(match, hour, minute, conversions, line))
+
+    if len(detections) != 0:
+        prefilter_counters["detected"] += 1
+    elif len(matches) != 0:
+        prefilter_counters["rejected_parser"] += 1
+    return detections
+
+
+# Returns all possible times in a message as a list of Match tuples
+# Runs the staged prefilter first, only the windows around time-like numbers are lowercased and scanned
+# counted is False for text seen before, such as an edited message, it is then left out of prefilter_counters
+def findMatches(message_text, counted=True):
+    message_content = str(message_text)
+    windows = prefilterWindows(message_content, counted)
+    matches = scanWindows(message_content, windows)
+    if counted:
+        countScanned(windows, matches)
+    return matches
+
+
+# Stages 1 and 2 of findMatches, returns the windows of a message worth scanning, empty if there are none
+def prefilterWindows(message_content, counted=True):
+    counters = prefilter_counters if counted else dict.fromkeys(prefilter_counters, 0)
+    counters["messages"] += 1
+
+    # Stage 1, a single pass looking for any digit
+    if scanner_digit.search(message_content) is None:
+        counters["rejected_digit"] += 1
+        return []
+
+    # Stage 2, windows around numbers that could be a time
+    windows = candidateWindows(message_content)
+    if len(windows) == 0:
+        counters["rejected_window"] += 1
+    return windows
+
+
+# Counts the outcome of stage 3 for a message whose windows were scanned into matches
+# Separate from scanWindows, which also runs in offload workers whose counters never reach metrics
+def countScanned(windows, matches):
+    if len(windows) == 0:
+        return
+    if len(matches) == 0:
+        prefilter_counters["rejected_scanner"] += 1
+    else:
+        prefilter_counters["matched"] += 1
+
+
+# Stage 3 of findMatches, the full scanner over each window
+def scanWindows(message_content, windows):
+    if len(windows) == 0:
+        return []
+    match_log.debug("Processing message: %s", message_content)
+    matches = []
+    for start, end in windows:
+        matches.extend(scanTimes(message_content[start:end].lower()))
+    return matches
+
+
+# Returns the (start, end) spans of a message which contain a number shaped like a time
+# Each span keeps the whole token before and after the number so the scanner sees the same words,
+# overlapping spans are merged so ranges stay in one window
+def candidateWindows(text):
+    length = len(text)
+    windows = []
+    for found in prefilter_number.finditer(text):
+        start, end = found.span()
+        if not isTimeShaped(found.group()) or isGlued(text, start):
+            continue
+
+        # Widen to whole tokens, whitespace is the only safe place to cut a message
+        windowStart = max(0, start - PREFILTER_WINDOW)
+        while windowStart > 0 and text[windowStart - 1].isspace():
+            windowStart -= 1
+        while windowStart > 0 and not text[windowStart - 1].isspace():
+            windowStart -= 1
+        windowEnd = min(length, end + PREFILTER_WINDOW)
+        while windowEnd < length and not text[windowEnd].isspace():
+            windowEnd += 1
+
+        if len(windows) != 0 and windowStart <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], windowEnd))
+        else:
+            windows.append((windowStart, windowEnd))
+    return windows
+
+
+# Checks if the number starting at index start is glued to a word, "mp3" or "v2"
+# Anything but whitespace and ASCII punctuation counts as part of a word, so lowercasing can't change the answer
+def isGlued(text, start):
+    return start > 0 and not text[start - 1].isspace() and text[start - 1] not in string.punctuation
+
+
+# Checks a digit run from prefilter_number has the shape of a time, "8", "830", "8:30" or "8:30:15"
+def isTimeShaped(number):
+    if "." in number or "," in number:
+        return False
+    parts = number.split(":")
+    if len(parts) == 1:
+        return len(number) <= 4
+    return len(parts[0]) <= 2 and len(parts[1]) <= 2
+
+
+# Single pass scanner over a lowercase message, every character is visited a bounded number of times
+# Numbers which are not shaped like a time (see isTimeShaped) or are glued to a word ("mp3") are
+# skipped entirely instead of being split into smaller numbers
+def scanTimes(text):
+    length = len(text)
+    matches = []
+
+    lastEnd = 0  # End of the previous number, the preceding word is never searched for past it
+    rangeWordStart = -1  # Start of the range word following the previous number, if any
+
+    position = 0
+    while True:
+        found = scanner_digit.search(text, position)
+        if found is None:
+            break
+        start = found.start()
+
+        # Read the whole number, including decimals, grouped digits and clock separators
+        end = start
+        while end < length and "0" <= text[end] <= "9":
+            end += 1
+        while end + 1 < length and text[end] in ".,:" and "0" <= text[end + 1] <= "9":
+            end += 1
+            while end < length and "0" <= text[end] <= "9":
+                end += 1
+        number = text[start:end]
+        valid = isTimeShaped(number) and not isGlued(text, start)
+
+        # Seconds are ignored, "8:30:15" is read as "8:30"
+        if valid and number.count(":") > 1:
+            number = number[:number.index(":", number.index(":") + 1)]
+
+        position = end
+        if not valid:
+            lastEnd = end
+            rangeWordStart = -1
+            continue
+
+        # Preceding word, separated from the number by whitespace only
+        wordEnd = start
+        while wordEnd > lastEnd and text[wordEnd - 1].isspace():
+            wordEnd -= 1
+        wordStart = wordEnd
+        while wordStart > lastEnd and (text[wordStart - 1].isalnum() or text[wordStart - 1] == "_"):
+            wordStart -= 1
+        before = text[wordStart:wordEnd]
+
+        # Following word, separated from the number by at most one whitespace character
+        afterStart = end
+        if afterStart < length and text[afterStart].isspace():
+            afterStart += 1
+        afterEnd = afterStart
+        while afterEnd < length and "a" <= text[afterEnd] <= "z":
+            afterEnd += 1
+        if afterEnd == afterStart and afterStart < length and not text[afterStart].isspace() \
+                and not "0" <= text[afterStart] <= "9":
+            afterEnd += 1  # Single symbol such as "%"
+        after = text[afterStart:afterEnd]
+
+        # Second half of a range, the range word must sit directly between both numbers
+        range_end = wordStart == rangeWordStart and before in words_range
+
+        matches.append(Match(before, number, after, range_end))
+        lastEnd = end
+        rangeWordStart = afterStart if after in words_range else -1
+
+    return matches
+
+
+# Filters scanned matches with the word lists, yields (match, hour, minute, am_pm) for each accepted match
+# am_pm: -1 = unknown, 0 = am, 1 = pm
+def parseMatches(matches, words=default_words):
+    # Look for times
+    for match in matches:
+        # match.before: preceding word
+        # match.number: number, may contain colon
+        # match.after: following word
+
+        match_log.info("Processing match: %s", match)
+        match_counters["matches"] += 1
+
+        # Boolean flags
+        positive = False
+
+        # Check for a colon, if found, skip this stage, else check words against list
+        if ":" not in match.number:
+            # Check against negative words
+            if match.before in words.before_negative:
+                match_log.info("Negative word found, before, match aborted")
+                match_counters["negative_before"] += 1
+                continue
+            elif match.after in words.after_negative:
+                match_log.info("Negative word found, after, match aborted")
+                match_counters["negative_after"] += 1
+                continue
+
+            # Check against positive words
+            if (match.before in words.before_positive) or (match.after in words.after_positive):
+                positive = True
+        else:
+            positive = True
+
+        # The second half of a range is always a match, "I'll be on from 8 to 9"
+        if match.range_end:
+            positive = True
+
+        # Check if a positive match was found, if not check for safemode, abort match if safemode = True
+        if not positive and SAFEMODE:
+            match_log.info("Safe mode enabled, match aborted")
+            match_counters["safemode"] += 1
+            continue
+
+        # Check for am/pm
+        am_pm = -1
+        if match.after == "am":
+            am_pm = 0
+        elif match.after == "pm":
+            am_pm = 1
+
+        hour, minute = parseTime(match.number)
+
+        match_log.debug("hour:%s, minute:%s, am_pm:%s", hour, minute, am_pm)
+
+        if hour == -1 or minute == -1:
+            logging.error("hour or minute is -1 beyond the time assignment block, match aborted")
+            match_counters["invalid"] += 1
+            continue
+
+        # Validate times
+        if minute > 59:
+            match_log.info("Invalid minute, match aborted")
+            match_counters["invalid"] += 1
+            continue
+        if am_pm == -1:
+            if hour > 23:
+                match_log.info("Invalid hour, match aborted")
+                match_counters["invalid"] += 1
+                continue
+        else:
+            if hour < 1 or hour > 12:
+                match_log.info("Invalid hour, match aborted")
+                match_counters["invalid"] += 1
+                continue
+
+        match_counters["accepted"] += 1
+        yield match, hour, minute, am_pm
+
+
+# Word list functions ----------------------------------------------------------------------
+# Builds a guild's WordLists from the defaults and its changes, guilds without changes share default_words
+# changes: list name --> {"add": [words], "remove": [words]}
+def compileWords(changes):
+    if not changes:
+        return default_words
+    lists = []
+    for name, defaults in zip(WORD_LISTS, default_words):
+        change = changes.get(name, {})
+        lists.append((defaults | frozenset(change.get("add", []))) - frozenset(change.get("remove", [])))
+    return WordLists(*lists)
+
+
+# Returns a copy of changes with word added to or removed from the named list
+def editWords(changes, name, word, add):
+    changes = {listName: {"add": list(change.get("add", [])), "remove": list(change.get("remove", []))}
+               for listName, change in (changes or {}).items()}
+    change = changes.setdefault(name, {"add": [], "remove": []})
+    default = word in getattr(default_words, name)
+
+    if add:
+        if word in change["remove"]:
+            change["remove"].remove(word)
+        elif not default and word not in change["add"]:
+            change["add"].append(word)
+    else:
+        if word in change["add"]:
+            change["add"].remove(word)
+        elif default and word not in change["remove"]:
+            change["remove"].append(word)
+
+    if len(change["add"]) == 0 and len(change["remove"]) == 0:
+        del changes[name]
+    return changes
+
+
+# Splits a detected number into (hour, minute), returns (-1, -1) if it cannot be split
+def parseTime(time):
+    time = str(time)  # Ease of use
+
+    # Time assignment block
+    try:
+        if ":" in time:
+            time = time.split(':')
+            return int(time[0]), int(time[1])
+
+        # Attempt to split based on length of string
+        if len(time) == 1 or len(time) == 2:
+            return int(time), 0
+        elif len(time) == 3:
+            return int(time[0]), int(time[1:3])
+        elif len(time) == 4:
+            return int(time[0:2]), int(time[2:4])
+
+    except Exception as e:
+        logging.error("Exception in hour/minute assignment block", exc_info=e)
+
+    return -1, -1
+
+
+# Guesses am/pm for a 12 hour time based on the sender's current local time (any object with hour and minute)
+def guessAmPm(hour, minute, currentTime):
+    currentHour = currentTime.hour
+    if currentHour > 12:
+        currentHour = currentTime.hour - 12
+
+    # If hour > currentHour, am/pm == am/pm local time
+    if hour > currentHour or (hour == currentHour and minute >= currentTime.minute):
+        am_pm = 0 if currentTime.hour < 12 else 1
+    else:
+        am_pm = 1 if currentTime.hour < 12 else 0
+
+    match_log.debug("am_pm guess: %s", am_pm)
+    return am_pm
+
+
+# Convert a 12 hour time to 24 hour based on am/pm
+def to24Hour(hour, am_pm):
+    if am_pm == 1 and hour != 12:
+        hour += 12
+    elif am_pm == 0 and hour == 12:
+        hour = 0
+    return hour
+
+
+# Builds the outgoing message for a list of detections, returns an empty string if there are none
+def formatReply(detections):
+    lines = []
+    for detection in detections:
+        lines.append(detection.line)
+    return "\n".join(lines)
@@ -0,0 +1,52 @@
+import time
+import datetime
+from collections import OrderedDict
+
+# Remembers the matches found in recent messages and the reply the bot sent for them, so an edited message is only
+# parsed again when the times in it changed, and the existing reply is edited instead of a second one being sent
+
+# Settings -------------------------------------------------------------------------
+EDIT_CACHE_SIZE = 5000  # Messages remembered, least recently used are dropped first
+EDIT_CACHE_TTL = 3600  # Seconds a message is remembered for, later edits are ignored
+
+# Edit Cache Setup -----------------------------------------------------------------
+# Message ID --> ProcessedMessage, least recently used first
+processed = OrderedDict()
+edit_counters = {"edits": 0, "unchanged": 0, "expired": 0, "updated": 0, "deleted": 0, "sent": 0}
+
+
+# What the bot did with one message
+class ProcessedMessage:
+    def __init__(self, matches, reply, content):
+        self.matches = matches  # Tuple of detection.Match found by the scanner
+        self.reply = reply  # Future from outbox.send set to the outbox.SentReply, None if there is no reply
+        self.content = content  # Text of the reply
+        self.expires = time.monotonic() + EDIT_CACHE_TTL
+
+
+# Edit cache functions -------------------------------------------------------------
+# Remembers a processed message, replacing what was remembered before, and returns its ProcessedMessage
+def remember(messageID, matches, reply=None, content=None):
+    entry = processed[messageID] = ProcessedMessage(tuple(matches), reply, content)
+    processed.move_to_end(messageID)
+    while len(processed) > EDIT_CACHE_SIZE:
+        processed.popitem(last=False)
+    return entry
+
+
+# Returns the ProcessedMessage of a message, None if it wasn't remembered or has expired
+def lookup(messageID):
+    entry = processed.get(messageID)
+    if entry is None:
+        return None
+    if entry.expires <= time.monotonic():
+        del processed[messageID]
+        return None
+    processed.move_to_end(messageID)
+    return entry
+
+
+# Whether a message not in the cache is recent enough for its edits to be handled, created_at is naive UTC
+# Messages without matches aren't remembered, an edit adding a time to one is handled like a new message
+def recent(created_at):
+    return (datetime.datetime.utcnow() - created_at).total_seconds() < EDIT_CACHE_TTL
@@ -0,0 +1,167 @@
+import io
+import sys
+import json
+import math
+import time
+import asyncio
+import logging
+import datetime
+import threading
+import traceback
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import edits
+import metrics
+import outbox
+import logqueue
+
+# Local health endpoint and event loop watchdog
+# GET http://127.0.0.1:HEALTH_PORT/health returns a JSON report, status 200 when healthy and 503 when the event loop
+# is blocked or the gateway is down. The endpoint and the watchdog run in threads so a stuck loop can still be seen
+
+# Settings -------------------------------------------------------------------------
+HEALTH_HOST = "127.0.0.1"  # Only reachable from this machine
+HEALTH_PORT = 8390  # launcher.py workers use HEALTH_PORT + 1 + worker ID
+LAG_INTERVAL = 0.25  # Seconds between event loop lag samples
+STALL_THRESHOLD = 2.0  # Seconds the loop can be blocked before the watchdog dumps every stack
+STALL_FILE = "stalls.log"  # Stack dumps are appended here
+
+# Health Setup ---------------------------------------------------------------------
+heartbeat = time.monotonic()  # Last time the lag sampler ran on the loop
+last_lag = 0.0  # Lag of the latest sample in seconds
+started = time.time()
+status = None  # Function returning the bot's own fields for the report, see start
+server = None
+
+
+# Health functions -----------------------------------------------------------------
+# Starts the lag sampler on loop, and the watchdog and HTTP server threads
+# statusFunction is called from the server thread and returns a dict of extra fields, "connected" False is unhealthy
+def start(loop, statusFunction, port=None):
+    global status, server, heartbeat
+    status = statusFunction
+    heartbeat = time.monotonic()
+    loop.create_task(sampleLag())
+    threading.Thread(target=watch, args=(loop, threading.get_ident()), name="watchdog", daemon=True).start()
+
+    port = HEALTH_PORT if port is None else port
+    try:
+        server = ThreadingHTTPServer((HEALTH_HOST, port), HealthHandler)
+    except OSError:
+        logging.exception("Could not start the health endpoint on %s:%s", HEALTH_HOST, port)
+        return
+    threading.Thread(target=server.serve_forever, name="health", daemon=True).start()
+    logging.info("Health endpoint listening on http://%s:%s/health", HEALTH_HOST, port)
+
+
+# Background task, measures how late the loop wakes a task sleeping for LAG_INTERVAL
+async def sampleLag():
+    global heartbeat, last_lag
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(LAG_INTERVAL)
+        heartbeat = time.monotonic()
+        last_lag = heartbeat - start - LAG_INTERVAL
+        metrics.loop_lag.observe(last_lag)
+        if last_lag > STALL_THRESHOLD:
+            logging.warning("Event loop was blocked for %.2f seconds", last_lag)
+
+
+# Watchdog thread, dumps the stacks once each time the loop stays blocked past STALL_THRESHOLD
+def watch(loop, loopThread):
+    dumped = False
+    while True:
+        time.sleep(LAG_INTERVAL)
+        blocked = blockedFor()
+        if blocked > STALL_THRESHOLD and not dumped:
+            dumped = True
+            try:
+                dumpStacks(loop, loopThread, blocked)
+            except Exception:
+                logging.exception("Failed to dump the stacks of a blocked event loop")
+        elif blocked <= STALL_THRESHOLD:
+            dumped = False
+
+
+# Seconds since the lag sampler should have run
+def blockedFor():
+    return max(0.0, time.monotonic() - heartbeat - LAG_INTERVAL)
+
+
+# Appends the loop thread's current stack and the stack of every task to STALL_FILE
+# The loop thread's stack shows what is blocking it, tasks show where everything else is waiting
+def dumpStacks(loop, loopThread, blocked):
+    lines = ["{} event loop blocked for {:.2f} seconds".format(datetime.datetime.now().isoformat(sep=" "), blocked)]
+    frame = sys._current_frames().get(loopThread)
+    if frame is not None:
+        lines.append("Event loop thread:")
+        lines.extend(line.rstrip("\n") for line in traceback.format_stack(frame))
+
+    # The task set can't change while the loop is blocked, retry in case it just woke up
+    for attempt in range(3):
+        try:
+            tasks = list(asyncio.all_tasks(loop))
+            break
+        except RuntimeError:
+            tasks = []
+    for task in tasks:
+        stack = io.StringIO()
+        task.print_stack(file=stack)
+        lines.append(stack.getvalue().rstrip("\n"))
+
+    with open(STALL_FILE, 'a') as file:
+        file.write("\n".join(lines) + "\n\n")
+    logging.warning("Event loop blocked for %.2f seconds, stacks of %s tasks written to %s", blocked, len(tasks), STALL_FILE)
+
+
+# Finite floats, None for the inf and nan discord.py reports before connecting
+def finite(value):
+    if value is None or math.isfinite(value):
+        return value
+    return None
+
+
+# Everything the endpoint reports, read from the server thread
+def report():
+    blocked = blockedFor()
+    fields = {
+        "uptime": round(time.time() - started, 1),
+        "loop_blocked_seconds": round(blocked, 3),
+        "loop_lag_seconds": round(last_lag, 4),
+        "loop_lag_p99_seconds": finite(metrics.loop_lag.quantile(0.99)),
+        "log_queue": logqueue.log_queue.qsize(),
+        "edit_cache": len(edits.processed),
+    }
+    # Reading the outbox races with the loop changing it, a changed dict only costs this field
+    try:
+        fields["outbox_backlog"] = outbox.backlog()
+        fields["outbox_channels"] = len(outbox.queues)
+    except RuntimeError:
+        pass
+    # status reads the bot's guilds while the loop changes them, retried like the task list in dumpStacks
+    if status is not None:
+        for attempt in range(3):
+            try:
+                fields.update({name: finite(value) if isinstance(value, float) else value for name, value in status().items()})
+                break
+            except RuntimeError:
+                pass
+    fields["healthy"] = blocked <= STALL_THRESHOLD and fields.get("connected", True)
+    return fields
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/health":
+            self.send_error(404)
+            return
+        fields = report()
+        body = json.dumps(fields).encode()
+        self.send_response(200 if fields["healthy"] else 503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Requests aren't logged, check_bot.sh may poll often
+    def log_message(self, format, *args):
+        pass
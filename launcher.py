@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import argparse
+import subprocess
+import discord
+from dotenv import load_dotenv
+import storage
+
+# Starts RealTimeBot.py as several worker processes, each connected to its own range of shards,
+# and restarts any worker which crashes. Every worker shares the sqlite backend (guilds.db in WAL mode)
+
+# Settings -------------------------------------------------------------------------
+WORKERS = 2  # Worker processes started when --workers isn't given
+RESTART_DELAY = 5  # Seconds before restarting a crashed worker, doubled for each crash in a row
+RESTART_DELAY_MAX = 300
+STABLE_TIME = 600  # A worker running this long is considered healthy again and restarts with RESTART_DELAY
+POLL_INTERVAL = 1  # Seconds between checks on the workers
+EXIT_STOPPED = 0  # A worker exited through the stop command, every worker is stopped
+EXIT_LOAD_FAILED = 3  # A worker couldn't load guilds (RealTimeBot.EXIT_LOAD_FAILED), it is restarted like a crash
+
+BOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "RealTimeBot.py")
+
+logging.basicConfig(filename="launcher.log",
+                    level=logging.INFO,
+                    datefmt='%Y-%m-%d %H:%M:%S',
+                    format='%(asctime)s %(levelname)-8s %(message)s')
+
+
+# A single RealTimeBot.py process and the shards it runs
+class Worker:
+    def __init__(self, workerID, shardIDs, shardCount):
+        self.workerID = workerID
+        self.shardIDs = shardIDs
+        self.shardCount = shardCount
+        self.process = None
+        self.started = 0
+        self.crashes = 0  # Crashes in a row, reset once the worker runs for STABLE_TIME
+        self.restartAt = None  # Time a crashed worker is restarted at
+
+    def start(self):
+        env = dict(os.environ)
+        env["WORKER_ID"] = str(self.workerID)
+        env["SHARD_IDS"] = ",".join(str(shardID) for shardID in self.shardIDs)
+        env["SHARD_COUNT"] = str(self.shardCount)
+        env["STORAGE_BACKEND"] = "sqlite"
+        self.process = subprocess.Popen([sys.executable, BOT_FILE], env=env, cwd=os.path.dirname(BOT_FILE))
+        self.started = time.monotonic()
+        self.restartAt = None
+        logging.info("Started worker %s (pid %s) with shards %s", self.workerID, self.process.pid, env["SHARD_IDS"])
+
+
+# Asks Discord how many shards the bot should use
+def recommendedShards(token):
+    async def fetch():
+        http = discord.http.HTTPClient()
+        try:
+            await http.static_login(token, bot=True)
+            shards, url = await http.get_bot_gateway()
+            return shards
+        finally:
+            await http.close()
+    return asyncio.run(fetch())
+
+
+# Splits shards 0..shardCount-1 into contiguous ranges, one per worker
+def assignShards(shardCount, workers):
+    workers = min(workers, shardCount)
+    ranges = []
+    for workerID in range(workers):
+        start = shardCount * workerID // workers
+        end = shardCount * (workerID + 1) // workers
+        ranges.append(list(range(start, end)))
+    return ranges
+
+
+# Creates or upgrades guilds.db before the workers race to do it, importing guilds.json the first time
+def prepareStore():
+    created = not os.path.exists(storage.SQLITE_FILE)
+    database = storage.SqliteStorage()
+    database.load()
+    if created and os.path.exists(storage.GUILDS_FILE):
+        database.importJson(storage.GUILDS_FILE)
+        logging.info("Imported %s into %s", storage.GUILDS_FILE, storage.SQLITE_FILE)
+    database.connection.close()
+
+
+def stopWorkers(workers):
+    for worker in workers:
+        if worker.process is not None and worker.process.poll() is None:
+            worker.process.terminate()
+    for worker in workers:
+        if worker.process is not None:
+            try:
+                worker.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+
+
+# Restarts crashed workers until a worker exits cleanly (the stop command) or the launcher is told to stop
+def supervise(workers):
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+    while len(stopping) == 0:
+        time.sleep(POLL_INTERVAL)
+        now = time.monotonic()
+        for worker in workers:
+            if worker.restartAt is not None:
+                if now >= worker.restartAt:
+                    worker.start()
+                continue
+
+            code = worker.process.poll()
+            if code is None:
+                if worker.crashes != 0 and now - worker.started >= STABLE_TIME:
+                    worker.crashes = 0
+                continue
+            if code == EXIT_STOPPED:
+                logging.info("Worker %s stopped, stopping every worker", worker.workerID)
+                stopWorkers(workers)
+                return
+
+            delay = min(RESTART_DELAY * 2 ** worker.crashes, RESTART_DELAY_MAX)
+            worker.crashes += 1
+            worker.restartAt = now + delay
+            if code == EXIT_LOAD_FAILED:
+                logging.warning("Worker %s couldn't load guilds, restarting in %s seconds", worker.workerID, delay)
+            else:
+                logging.warning("Worker %s exited with code %s, restarting in %s seconds", worker.workerID, code, delay)
+
+    logging.info("Received signal %s, stopping every worker", stopping[0])
+    stopWorkers(workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run RealTimeBot as sharded worker processes")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Number of worker processes")
+    parser.add_argument("--shards", type=int, default=None, help="Total shard count, Discord's recommendation if omitted")
+    args = parser.parse_args()
+
+    load_dotenv()
+    shardCount = args.shards
+    if shardCount is None:
+        shardCount = recommendedShards(os.getenv('DISCORD_TOKEN'))
+    # Every worker needs at least one shard
+    shardCount = max(shardCount, args.workers)
+
+    prepareStore()
+    workers = [Worker(workerID, shardIDs, shardCount) for workerID, shardIDs in enumerate(assignShards(shardCount, args.workers))]
+    logging.info("Running %s shards over %s workers", shardCount, len(workers))
+    for worker in workers:
+        worker.start()
+    supervise(workers)
@@ -0,0 +1,94 @@
+import queue
+import atexit
+import logging
+import logging.handlers
+
+# Settings -------------------------------------------------------------------------
+LOG_FILE = "RealTimeBot.log"
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Size at which the log file is rotated
+LOG_BACKUPS = 5  # Rotated files kept, RealTimeBot.log.1 to RealTimeBot.log.5
+LOG_FORMAT = '%(asctime)s %(levelname)-8s %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+# Per category sampling, logger name --> keep 1 in N records below WARNING
+# Categories are logger names, a category also covers its children ("detection" covers "detection.match")
+# Warnings and errors are never sampled out
+LOG_SAMPLING = {
+    "RealTimeBot.message": 100,  # Messages ignored before conversion: bots, no matches, opted out users
+    "detection.match": 100,  # Every match the word lists accept or reject
+}
+
+# Queue Setup ----------------------------------------------------------------------
+# Records go from the event loop onto this queue, the listener thread does the file I/O
+log_queue = queue.SimpleQueue()
+listener = None
+
+# Records dropped by sampling, category --> count
+sampled_out = {}
+
+
+# Keeps 1 in N records of each sampled category, the first record of a category is always kept
+class SamplingFilter(logging.Filter):
+    def __init__(self, sampling):
+        super().__init__()
+        self.sampling = sampling
+        self.seen = {}
+        self.categories = {}  # Logger name --> category, None if the logger isn't sampled
+
+    def category(self, name):
+        if name not in self.categories:
+            category = name
+            while category not in self.sampling and "." in category:
+                category = category.rsplit(".", 1)[0]
+            self.categories[name] = category if category in self.sampling else None
+        return self.categories[name]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        category = self.category(record.name)
+        if category is None:
+            return True
+
+        seen = self.seen.get(category, 0)
+        self.seen[category] = seen + 1
+        if seen % self.sampling[category] == 0:
+            return True
+        sampled_out[category] = sampled_out.get(category, 0) + 1
+        return False
+
+
+# Functions ------------------------------------------------------------------------
+# Routes the root logger through the queue and starts the thread writing the rotating log file
+def start(level, sampling=None):
+    global listener
+    if listener is not None:
+        return
+
+    sink = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                                encoding="utf-8", delay=True)
+    sink.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFMT))
+
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(LOG_SAMPLING if sampling is None else sampling))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+
+    listener = logging.handlers.QueueListener(log_queue, sink, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop)
+
+
+# Writes every queued record and stops the listener thread
+def stop():
+    global listener
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    listener = None
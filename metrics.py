@@ -0,0 +1,214 @@
+import os
+import asyncio
+import logging
+from bisect import bisect_left
+import detection
+import conversion
+import edits
+import logqueue
+
+# Settings -------------------------------------------------------------------------
+METRICS_FILE = "metrics.prom"  # Prometheus text dump, point a node_exporter textfile collector at it
+METRICS_INTERVAL = 30  # Seconds between dumps
+
+# Upper bounds of the latency buckets in seconds, from 10us to 5s
+LATENCY_BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5]
+
+# Upper bounds of the matches per message buckets
+MATCH_BUCKETS = [0, 1, 2, 3, 5, 10, 25]
+
+# Stages of on_message, in pipeline order
+# prefix: bot and command checks, scan: prefilter and scanner (findMatches, which also lowercases),
+# check_user: record lookup, convert: parsing and converting every match,
+# queue: time a reply waited in the channel's outbox, send: reply to the channel
+STAGES = ["prefix", "scan", "check_user", "convert", "queue", "send"]
+
+
+# Fixed bucket histogram, counts[i] is the number of observations <= buckets[i], the last count is +Inf
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Upper bound of the bucket holding the q quantile, None if nothing has been observed
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count != 0:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+# Metrics Setup --------------------------------------------------------------------
+# Time spent in each stage of on_message
+stage_seconds = {stage: Histogram(LATENCY_BUCKETS) for stage in STAGES}
+
+# Matches found by the scanner in each message that reached it
+matches_per_message = Histogram(MATCH_BUCKETS)
+
+# How late the event loop woke the lag sampler, see health.py
+loop_lag = Histogram(LATENCY_BUCKETS)
+
+# Events not covered by the detection counters
+counters = {"messages": 0, "commands": 0, "replies": 0, "coalesced": 0, "send_failures": 0, "compacted_records": 0,
+            "compacted_bytes": 0, "offloaded": 0, "shed_welcomes": 0, "shed_messages": 0, "shed_commands": 0}
+
+# Values read when the metrics are shown, name --> function returning the current value
+gauges = {}
+
+# Seconds spent in the CPU bound stages for each guild, guild ID --> [seconds, messages]
+guild_seconds = {}
+
+
+# Functions ------------------------------------------------------------------------
+# Records the time spent in a stage, charged to guildID unless the stage is waiting on Discord
+def observe(stage, seconds, guildID=None):
+    stage_seconds[stage].observe(seconds)
+    if guildID is not None:
+        usage = guild_seconds.get(guildID)
+        if usage is None:
+            usage = guild_seconds[guildID] = [0.0, 0]
+        usage[0] += seconds
+
+
+# Counts a message which reached on_message
+def countMessage(guildID):
+    counters["messages"] += 1
+    usage = guild_seconds.get(guildID)
+    if usage is None:
+        usage = guild_seconds[guildID] = [0.0, 0]
+    usage[1] += 1
+
+
+# Guilds using the most time, [(guild ID, seconds, messages)]
+def topGuilds(count):
+    usage = sorted(guild_seconds.items(), key=lambda item: item[1][0], reverse=True)[:count]
+    return [(guildID, seconds, messages) for guildID, (seconds, messages) in usage]
+
+
+def formatSeconds(seconds):
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return ">{}s".format(LATENCY_BUCKETS[-1])
+    if seconds < 0.001:
+        return "{:.0f}us".format(seconds * 1e6)
+    if seconds < 1:
+        return "{:.1f}ms".format(seconds * 1e3)
+    return "{:.2f}s".format(seconds)
+
+
+# Summary for the -stats command
+def formatStats(guildCount=5):
+    lines = ["stage        count     p50      p99      total"]
+    for stage in STAGES:
+        histogram = stage_seconds[stage]
+        lines.append("{:<12} {:<9} {:<8} {:<8} {}".format(stage, histogram.count, formatSeconds(histogram.quantile(0.5)),
+                                                      formatSeconds(histogram.quantile(0.99)), formatSeconds(histogram.sum)))
+
+    lines.append("{:<12} {:<9} {:<8} {:<8} {}".format("loop lag", loop_lag.count, formatSeconds(loop_lag.quantile(0.5)),
+                                                  formatSeconds(loop_lag.quantile(0.99)), formatSeconds(loop_lag.sum)))
+
+    lines.append("")
+    lines.append("messages {messages}, commands {commands}, replies {replies}, coalesced {coalesced}, "
+                 "send failures {send_failures}, offloaded {offloaded}".format(**counters))
+    lines.append("compacted {compacted_records} records, {compacted_bytes} bytes".format(**counters))
+    lines.append("shed {shed_welcomes} welcomes, {shed_messages} old messages, {shed_commands} commands".format(**counters))
+    if len(gauges) != 0:
+        lines.append(", ".join("{} {}".format(name, gauge()) for name, gauge in gauges.items()))
+    if matches_per_message.count != 0:
+        lines.append("matches per message: mean {:.2f}, p99 <= {}".format(matches_per_message.sum / matches_per_message.count,
+                                                                         matches_per_message.quantile(0.99)))
+    lines.append("prefilter: " + ", ".join("{} {}".format(name, count) for name, count in detection.prefilter_counters.items()))
+    lines.append("matches: " + ", ".join("{} {}".format(name, count) for name, count in detection.match_counters.items()))
+    lines.append("conversion cache: " + ", ".join("{} {}".format(name, count) for name, count in conversion.conversion_stats.items()))
+    lines.append("edits: " + ", ".join("{} {}".format(name, count) for name, count in edits.edit_counters.items()))
+
+    top = topGuilds(guildCount)
+    if len(top) != 0:
+        lines.append("")
+        lines.append("busiest guilds:")
+        for guildID, seconds, messages in top:
+            lines.append("  {} {} over {} messages".format(guildID, formatSeconds(seconds), messages))
+    return "\n".join(lines)
+
+
+def formatLabel(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def renderHistogram(lines, name, histogram, labels=""):
+    separator = "," if labels else ""
+    cumulative = 0
+    for index, count in enumerate(histogram.counts):
+        cumulative += count
+        bound = "+Inf" if index == len(histogram.buckets) else repr(histogram.buckets[index])
+        lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(name, labels, separator, bound, cumulative))
+    suffix = "{" + labels + "}" if labels else ""
+    lines.append("{}_sum{} {}".format(name, suffix, repr(float(histogram.sum))))
+    lines.append("{}_count{} {}".format(name, suffix, histogram.count))
+
+
+def renderCounters(lines, name, label, values):
+    lines.append("# TYPE {} counter".format(name))
+    for key, value in values.items():
+        lines.append('{}{{{}="{}"}} {}'.format(name, label, formatLabel(key), value))
+
+
+# Every metric in the Prometheus text exposition format
+def renderPrometheus():
+    lines = ["# HELP realtimebot_stage_seconds Time spent in each stage of on_message",
+             "# TYPE realtimebot_stage_seconds histogram"]
+    for stage in STAGES:
+        renderHistogram(lines, "realtimebot_stage_seconds", stage_seconds[stage], 'stage="{}"'.format(stage))
+
+    lines.append("# HELP realtimebot_matches_per_message Matches found by the scanner in each message")
+    lines.append("# TYPE realtimebot_matches_per_message histogram")
+    renderHistogram(lines, "realtimebot_matches_per_message", matches_per_message)
+
+    lines.append("# HELP realtimebot_loop_lag_seconds How late the event loop woke a task sleeping for a fixed interval")
+    lines.append("# TYPE realtimebot_loop_lag_seconds histogram")
+    renderHistogram(lines, "realtimebot_loop_lag_seconds", loop_lag)
+
+    renderCounters(lines, "realtimebot_events_total", "event", counters)
+    for name, gauge in gauges.items():
+        lines.append("# TYPE realtimebot_{} gauge".format(name))
+        lines.append("realtimebot_{} {}".format(name, gauge()))
+    renderCounters(lines, "realtimebot_prefilter_total", "result", detection.prefilter_counters)
+    renderCounters(lines, "realtimebot_matches_total", "result", detection.match_counters)
+    renderCounters(lines, "realtimebot_conversion_cache_total", "event", conversion.conversion_stats)
+    renderCounters(lines, "realtimebot_edits_total", "result", edits.edit_counters)
+    renderCounters(lines, "realtimebot_log_sampled_out_total", "category", logqueue.sampled_out)
+    renderCounters(lines, "realtimebot_guild_seconds_total", "guild", {guildID: repr(usage[0]) for guildID, usage in guild_seconds.items()})
+    renderCounters(lines, "realtimebot_guild_messages_total", "guild", {guildID: usage[1] for guildID, usage in guild_seconds.items()})
+    return "\n".join(lines) + "\n"
+
+
+def writeFile(text, path=None):
+    path = METRICS_FILE if path is None else path
+    temp = path + ".tmp"
+    with open(temp, 'w') as file:
+        file.write(text)
+    os.replace(temp, path)
+
+
+# Background task, dumps every metric to METRICS_FILE every METRICS_INTERVAL seconds
+async def dumpLoop():
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, writeFile, renderPrometheus())
+        except Exception:
+            logging.exception("An error occurred while writing %s", METRICS_FILE)
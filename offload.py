@@ -0,0 +1,122 @@
+import gc
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import detection
+import tztables
+
+# Parses expensive messages in worker processes so a huge message, or a burst of them, can't block the event loop
+# Workers are forked once the guilds and zone tables are loaded, so they start with the compiled matchers and tables.
+# The cheap prefilter stages always run on the loop, only messages with candidate windows are sent to a worker.
+# The match, detection and conversion counters of offloaded messages are counted in the workers and don't reach metrics
+
+# Settings -------------------------------------------------------------------------
+OFFLOAD_WORKERS = 2  # Worker processes
+OFFLOAD_LENGTH = 1000  # Messages this long or longer are offloaded
+OFFLOAD_WINDOWS = 10  # Messages with this many candidate windows or more are offloaded, see detection.candidateWindows
+OFFLOAD_LAG = 0.1  # Seconds of event loop lag past which every message with a candidate is offloaded, see health.py
+
+# Offload Setup --------------------------------------------------------------------
+pool = None  # ProcessPoolExecutor, None parses everything on the event loop
+
+# Channel ID --> future set once the latest message of the channel holding a place in line is done, see takePlace
+# Only channels with offloaded messages in flight are here, messages of other channels don't wait on anything
+tails = {}
+
+
+# Offload functions ----------------------------------------------------------------
+# Forks the workers and waits until each is running, call before the event loop starts so no other threads are forked
+# zones are the zone tables to build in the workers, any they already have from this process are kept
+def start(zones, workers=None):
+    global pool
+    workers = OFFLOAD_WORKERS if workers is None else workers
+
+    # Objects which exist now are left out of garbage collection so the workers don't copy every page they are on
+    gc.freeze()
+    try:
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"), initializer=warmWorker,
+                                   initargs=(zones,))
+        for future in [pool.submit(ping) for _ in range(workers)]:
+            future.result()
+    finally:
+        gc.unfreeze()
+    logging.info("Started %s offload workers", workers)
+
+
+def stop():
+    global pool
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+        pool = None
+
+
+# Runs in each worker as it starts
+def warmWorker(zones):
+    # The log queue's thread wasn't forked, worker warnings and errors go to stderr instead
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.StreamHandler())
+    root.setLevel(logging.WARNING)
+    tztables.buildTables(zones)
+
+
+def ping():
+    return True
+
+
+# True when content is costly enough to be worth the round trip to a worker, lag is the event loop's latest lag
+# windows are its candidate windows from detection.prefilterWindows, messages without any are done already
+def shouldOffload(content, windows, lag=0.0):
+    if pool is None or len(windows) == 0:
+        return False
+    return lag >= OFFLOAD_LAG or len(content) >= OFFLOAD_LENGTH or len(windows) >= OFFLOAD_WINDOWS
+
+
+# Runs in a worker: scans the windows of content and, when senderZone is set, converts its matches
+# Returns (matches, reply), reply is empty when there is nothing to convert
+def parseMessage(content, windows, senderZone, guildZones, timestamp, words):
+    matches = detection.scanWindows(content, windows)
+    if senderZone is None or len(matches) == 0:
+        return matches, ""
+    return matches, detection.formatReply(detection.detectMatches(matches, senderZone, guildZones, timestamp, words))
+
+
+# parseMessage in a worker, inline if the pool has failed
+async def parse(content, windows, senderZone, guildZones, timestamp, words):
+    global pool
+    if pool is not None:
+        try:
+            return await asyncio.get_event_loop().run_in_executor(pool, parseMessage, content, windows, senderZone,
+                                                                  guildZones, timestamp, words)
+        except BrokenProcessPool:
+            logging.exception("An offload worker died, parsing every message on the event loop from now on")
+            pool = None
+    return parseMessage(content, windows, senderZone, guildZones, timestamp, words)
+
+
+# Takes a place in line for a message of channelID, returns (previous, done)
+# The message awaits previous before it replies, and its place is released with leave once it is done
+def takePlace(channelID):
+    previous = tails.get(channelID)
+    done = asyncio.get_event_loop().create_future()
+    tails[channelID] = done
+    return previous, done
+
+
+# A message which didn't reply may leave before the ones ahead of it, its place is then kept until they are done
+def leave(channelID, previous, done):
+    if previous is not None and not previous.done():
+        previous.add_done_callback(lambda future: leave(channelID, None, done))
+        return
+    if not done.done():
+        done.set_result(None)
+    if tails.get(channelID) is done:
+        del tails[channelID]
+
+
+# Needs a place in line: the message is offloaded, or an offloaded message of its channel hasn't replied yet
+def needsPlace(channelID, offloaded):
+    return offloaded or channelID in tails
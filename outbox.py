@@ -0,0 +1,215 @@
+import time
+import asyncio
+import logging
+import discord
+import metrics
+
+# Settings -------------------------------------------------------------------------
+CHANNEL_BURST = 5  # Messages a channel can send at once, Discord allows 5 per 5 seconds per channel
+CHANNEL_RATE = 1.0  # Messages per second the bucket refills at
+COALESCE_WINDOW = 0.5  # Seconds after a send during which further replies are held and merged into one message
+MAX_MESSAGE_LENGTH = 2000  # Discord's limit, merged replies are split at line boundaries to stay under it
+QUEUE_LIMIT = 10000  # Idle channel queues are pruned once this many exist
+
+# Outbox Setup ---------------------------------------------------------------------
+# Outgoing queue of every channel the bot has replied in, channel ID --> ChannelQueue
+queues = {}
+
+
+# Replies waiting for one channel, with the token bucket limiting how fast they go out
+class ChannelQueue:
+    def __init__(self):
+        self.tokens = CHANNEL_BURST
+        self.updated = time.monotonic()
+        self.holdUntil = 0  # Replies before this time are held for merging
+        self.pending = []  # (content, monotonic time queued, future set once it is sent)
+        self.lock = asyncio.Lock()  # Held while sending, keeps the channel's replies in order
+        self.task = None  # Task draining pending, None when nothing is queued
+
+    def refill(self, now):
+        self.tokens = min(CHANNEL_BURST, self.tokens + (now - self.updated) * CHANNEL_RATE)
+        self.updated = now
+
+    # Seconds until the next send is allowed
+    def delay(self, now):
+        self.refill(now)
+        wait = max(0, self.holdUntil - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / CHANNEL_RATE)
+        return wait
+
+    def idle(self, now):
+        self.refill(now)
+        return self.task is None and len(self.pending) == 0 and self.tokens >= CHANNEL_BURST
+
+
+# A sent message and the replies merged into it, a reply is changed by replacing its part and editing the message
+class SentMessage:
+    def __init__(self, message, parts):
+        self.message = message
+        self.parts = parts  # Reply of each group of lines in the order they were joined, None once one is removed
+        self.shares = [0] * len(parts)  # Replies carried by each part, exact repeats are merged into one
+
+    def text(self, parts):
+        return "\n".join(part for part in parts if part is not None)
+
+
+# Where one reply ended up: the part of a SentMessage which carries its lines
+class SentReply:
+    def __init__(self, sent, part):
+        self.sent = sent
+        self.part = part
+
+    @property
+    def message(self):
+        return self.sent.message
+
+
+# Outbox functions -----------------------------------------------------------------
+# Sends a reply to channel, right away if the channel is idle, otherwise it is queued and merged with
+# the other replies waiting for that channel
+# Returns a future set to the SentReply once the reply went out, None if it couldn't be sent
+async def send(channel, content):
+    queue = getQueue(channel.id)
+    now = time.monotonic()
+    future = asyncio.get_event_loop().create_future()
+    if queue.task is None and not queue.lock.locked() and queue.delay(now) == 0:
+        async with queue.lock:
+            await deliver(channel, queue, [(content, now, future)])
+        return future
+
+    queue.pending.append((content, now, future))
+    if queue.task is None:
+        queue.task = asyncio.ensure_future(drain(channel, queue))
+    return future
+
+
+# Sends everything queued for a channel as fast as its bucket allows, one merged message at a time
+async def drain(channel, queue):
+    try:
+        while len(queue.pending) != 0:
+            delay = queue.delay(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            async with queue.lock:
+                batch = queue.pending
+                queue.pending = []
+                await deliver(channel, queue, batch)
+    finally:
+        queue.task = None
+        # Replies still queued when the task is cancelled are never sent
+        for content, queued, future in queue.pending:
+            if not future.done():
+                future.set_result(None)
+        queue.pending = []
+
+
+# Merges a batch of replies into as few messages as fit and sends them, each message takes a token
+# Sets the future of every reply to where it was sent, None if its message failed
+async def deliver(channel, queue, batch):
+    now = time.monotonic()
+    for content, queued, future in batch:
+        metrics.observe("queue", now - queued)
+    if len(batch) > 1:
+        metrics.counters["coalesced"] += len(batch) - 1
+
+    messages, placement = mergeReplies([content for content, queued, future in batch])
+    sent = []
+    try:
+        for parts in messages:
+            start = time.monotonic()
+            queue.refill(start)
+            queue.tokens -= 1
+            try:
+                sent.append(SentMessage(await channel.send("\n".join(parts)), parts))
+                metrics.counters["replies"] += 1
+            except discord.HTTPException:
+                sent.append(None)
+                metrics.counters["send_failures"] += 1
+                logging.exception("Failed to send a reply to channel %s", channel.id)
+            metrics.observe("send", time.monotonic() - start)
+    finally:
+        queue.holdUntil = time.monotonic() + COALESCE_WINDOW
+        for (content, queued, future), (index, part) in zip(batch, placement):
+            message = sent[index] if index < len(sent) else None
+            if message is not None:
+                message.shares[part] += 1
+            if not future.done():
+                future.set_result(None if message is None else SentReply(message, part))
+
+
+# Groups replies into messages of at most MAX_MESSAGE_LENGTH once joined with newlines, dropping exact repeats
+# Returns (messages, placement), messages are the replies each message joins and placement[i] is the
+# (message, part) index pair carrying replies[i], a repeat is placed with the reply it repeats
+def mergeReplies(replies):
+    messages = []
+    placement = []
+    seen = {}
+    length = 0
+    for reply in replies:
+        if reply not in seen:
+            if len(messages) == 0 or length + 1 + len(reply) > MAX_MESSAGE_LENGTH:
+                messages.append([reply])
+                length = len(reply)
+            else:
+                messages[-1].append(reply)
+                length += 1 + len(reply)
+            seen[reply] = (len(messages) - 1, len(messages[-1]) - 1)
+        placement.append(seen[reply])
+    return messages, placement
+
+
+# Replaces a sent reply with content, or removes it when content is empty, only its lines of the message change
+# The message is deleted once it carries no replies. Raises discord.HTTPException if the edit failed
+# Returns False when content still has to be sent on its own: the reply's lines are shared with an identical
+# reply, the message would get too long or it was deleted
+async def editReply(channel, reply, content):
+    sent = reply.sent
+    async with getQueue(channel.id).lock:
+        if sent.parts[reply.part] is None:
+            return len(content) == 0
+        if sent.shares[reply.part] > 1:
+            sent.shares[reply.part] -= 1
+            return len(content) == 0
+
+        parts = list(sent.parts)
+        parts[reply.part] = content if len(content) != 0 else None
+        fits = len(sent.text(parts)) <= MAX_MESSAGE_LENGTH
+        if not fits:
+            parts[reply.part] = None
+        try:
+            if len(sent.text(parts)) == 0:
+                await sent.message.delete()
+            else:
+                await sent.message.edit(content=sent.text(parts))
+        except discord.NotFound:
+            sent.parts = [None] * len(parts)
+            return len(content) == 0
+        sent.parts = parts
+        return fits
+
+
+def getQueue(channelID):
+    queue = queues.get(channelID)
+    if queue is None:
+        if len(queues) >= QUEUE_LIMIT:
+            prune()
+        queue = queues[channelID] = ChannelQueue()
+    return queue
+
+
+# Drops the queues of channels with nothing queued and a full bucket, they behave the same as a new queue
+def prune():
+    now = time.monotonic()
+    for channelID in [channelID for channelID, queue in queues.items() if queue.idle(now)]:
+        del queues[channelID]
+
+
+# Replies queued over every channel
+def backlog():
+    return sum(len(queue.pending) for queue in queues.values())
+
+
+metrics.gauges["outbox_backlog"] = backlog
+metrics.gauges["outbox_channels"] = lambda: len(queues)
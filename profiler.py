@@ -0,0 +1,108 @@
+import io
+import os
+import time
+import pstats
+import asyncio
+import cProfile
+import logging
+import tracemalloc
+
+# On demand profiling of the running bot for the -profile command, nothing is enabled until a capture starts
+# cpu: cProfile over the event loop thread, where every message and command is handled
+# memory: tracemalloc, allocation sites which grew the most between the start and the end of the capture
+
+# Settings -------------------------------------------------------------------------
+PROFILE_DIR = "profiles"  # Reports are written here
+PROFILE_MAX_SECONDS = 600  # Longest capture allowed
+TRACEMALLOC_FRAMES = 10  # Frames kept for each allocation, more show more context but cost more while tracing
+REPORT_ENTRIES = 50  # Functions and allocation sites written to the reports
+SUMMARY_ENTRIES = 8  # Entries of each report posted back to the channel
+
+# Profiler Setup -------------------------------------------------------------------
+running = False  # Only one capture at a time, profilers can't be nested
+
+
+# Profiler functions ---------------------------------------------------------------
+# Profiles the live process for seconds, writes the reports to PROFILE_DIR and returns a summary for the channel
+async def capture(seconds, cpu=True, memory=True):
+    global running
+    running = True
+    name = time.strftime("%Y%m%d-%H%M%S")
+    profile = None
+    startSnapshot = endSnapshot = None
+    peak = 0
+    try:
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            startSnapshot = tracemalloc.take_snapshot()
+        if cpu:
+            profile = cProfile.Profile()
+            profile.enable()
+        logging.info("Profiling for %s seconds (cpu %s, memory %s)", seconds, cpu, memory)
+
+        await asyncio.sleep(seconds)
+
+        if startSnapshot is not None:
+            endSnapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if profile is not None:
+            profile.disable()
+        if startSnapshot is not None:
+            tracemalloc.stop()
+        running = False
+
+    # Reports are formatted away from the loop, a large profile takes a while to sort
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    loop = asyncio.get_event_loop()
+    summary = ["Profiled {} seconds".format(seconds)]
+    if profile is not None:
+        summary.append(await loop.run_in_executor(None, writeCpuReport, profile, os.path.join(PROFILE_DIR, "cpu-" + name)))
+    if endSnapshot is not None:
+        summary.append(await loop.run_in_executor(None, writeMemoryReport, startSnapshot, endSnapshot, peak,
+                                                  os.path.join(PROFILE_DIR, "memory-" + name)))
+    elif memory:
+        summary.append("memory: tracemalloc was already tracing, skipped")
+    return "\n\n".join(summary)
+
+
+# Writes the raw stats (.prof, for snakeviz or pstats) and a report sorted by cumulative and own time
+def writeCpuReport(profile, path):
+    profile.dump_stats(path + ".prof")
+    with open(path + ".txt", 'w') as file:
+        stats = pstats.Stats(profile, stream=file)
+        stats.sort_stats("cumulative").print_stats(REPORT_ENTRIES)
+        stats.sort_stats("tottime").print_stats(REPORT_ENTRIES)
+
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    lines = ["cpu: {} calls, {:.2f}s, written to {}.txt, top own time:".format(stats.total_calls, stats.total_tt, path)]
+    for function, (primitive, calls, own, cumulative, callers) in sorted(stats.stats.items(), key=lambda item: item[1][2],
+                                                                      reverse=True)[:SUMMARY_ENTRIES]:
+        filename, line, functionName = function
+        lines.append("  {:>8.3f}s {:>8} {}:{}({})".format(own, calls, os.path.basename(filename), line, functionName))
+    return "\n".join(lines)
+
+
+# Writes the allocation sites which grew the most over the capture, by line and by full traceback
+def writeMemoryReport(startSnapshot, endSnapshot, peak, path):
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    startSnapshot = startSnapshot.filter_traces(filters)
+    endSnapshot = endSnapshot.filter_traces(filters)
+    byLine = endSnapshot.compare_to(startSnapshot, "lineno")
+    with open(path + ".txt", 'w') as file:
+        file.write("Growth by line\n")
+        for statistic in byLine[:REPORT_ENTRIES]:
+            file.write("{}\n".format(statistic))
+        file.write("\nGrowth by traceback\n")
+        for statistic in endSnapshot.compare_to(startSnapshot, "traceback")[:REPORT_ENTRIES]:
+            file.write("{}\n".format(statistic))
+            file.write("\n".join(statistic.traceback.format()) + "\n")
+
+    grown = sum(statistic.size_diff for statistic in byLine)
+    lines = ["memory: {:+.1f} KiB traced, peak {:.1f} MiB, written to {}.txt, top growth:".format(
+        grown / 1024, peak / 1048576, path)]
+    for statistic in byLine[:SUMMARY_ENTRIES]:
+        frame = statistic.traceback[0]
+        lines.append("  {:>+10.1f} KiB {:>+8} {}:{}".format(statistic.size_diff / 1024, statistic.count_diff,
+                                                           os.path.basename(frame.filename), frame.lineno))
+    return "\n".join(lines)
@@ -0,0 +1,244 @@
+import re
+import time
+import logging
+import pytz
+
+# Resolves what a user types after -timezone into an IANA zone name: zone names, abbreviations, cities and UTC offsets
+# Exact names are a dict lookup, partial and misspelled names are matched through a trie of every name
+
+# Settings -------------------------------------------------------------------------
+MAX_SUGGESTIONS = 5  # Zones listed when a name is ambiguous or unknown
+RESOLVE_MIN_LENGTH = 4  # Shorter names only resolve exactly, partial ones are suggested and misspellings aren't matched
+FUZZY_DISTANCE = 2  # Largest edit distance accepted for names of at least FUZZY_MIN_LENGTH characters
+FUZZY_MIN_LENGTH = 5  # Shorter names only accept one edit
+
+# Abbreviations and common names, these win over IANA names of the same spelling ("est" is US/Eastern, not EST)
+zone_aliases = {
+    "US/Eastern": ["est", "edt", "et", "east", "eastern"],
+    "US/Central": ["cst", "cdt", "ct", "central"],
+    "US/Mountain": ["mst", "mdt", "mt", "mountain"],
+    "US/Pacific": ["pst", "pdt", "pt", "pacific"],
+    "US/Arizona": ["arizona", "phoenix"],
+    "US/Alaska": ["akst", "akdt", "alaska"],
+    "US/Hawaii": ["hst", "hawaii"],
+    "America/Halifax": ["ast", "adt", "atlantic"],
+    "America/St_Johns": ["nst", "ndt", "newfoundland"],
+    "UTC": ["utc", "gmt", "z", "zulu"],
+    "Europe/London": ["bst", "uk", "britain", "england"],
+    "Europe/Dublin": ["ireland"],
+    "Europe/Lisbon": ["wet", "west", "portugal"],
+    "Europe/Berlin": ["cet", "cest", "germany"],
+    "Europe/Paris": ["france"],
+    "Europe/Athens": ["eet", "eest", "greece"],
+    "Europe/Moscow": ["msk", "russia"],
+    "Asia/Kolkata": ["ist", "india"],
+    "Asia/Shanghai": ["china"],
+    "Asia/Tokyo": ["jst", "japan"],
+    "Asia/Seoul": ["kst", "korea"],
+    "Asia/Singapore": ["sgt"],
+    "Asia/Hong_Kong": ["hkt"],
+    "Asia/Manila": ["pht", "philippines"],
+    "Asia/Jakarta": ["wib", "indonesia"],
+    "Australia/Sydney": ["aest", "aedt"],
+    "Australia/Adelaide": ["acst", "acdt"],
+    "Australia/Perth": ["awst"],
+    "Pacific/Auckland": ["nzst", "nzdt", "new zealand"],
+    "America/Sao_Paulo": ["brt", "brazil"],
+    "America/Argentina/Buenos_Aires": ["art", "argentina"],
+    "America/Mexico_City": ["mexico"],
+}
+
+# Major cities which aren't the city in a zone name, and US cities kept on the US/ zones existing users already have
+city_zones = {
+    "US/Eastern": ["new york", "new york city", "nyc", "detroit", "boston", "washington", "washington dc", "philadelphia",
+                   "atlanta", "miami", "orlando", "pittsburgh", "cleveland", "charlotte", "baltimore", "columbus",
+                   "raleigh", "tampa", "ottawa", "montreal", "quebec"],
+    "US/Central": ["chicago", "dallas", "houston", "austin", "san antonio", "minneapolis", "st louis", "kansas city",
+                   "nashville", "new orleans", "memphis", "milwaukee", "oklahoma city", "omaha", "winnipeg"],
+    "US/Mountain": ["denver", "salt lake city", "albuquerque", "el paso", "calgary", "boise"],
+    "US/Pacific": ["los angeles", "la", "san francisco", "seattle", "portland", "san diego", "san jose", "las vegas",
+                   "sacramento", "oakland"],
+    "Europe/London": ["manchester", "birmingham", "liverpool", "leeds", "glasgow", "edinburgh", "cardiff", "bristol"],
+    "Europe/Berlin": ["munich", "frankfurt", "hamburg", "cologne", "stuttgart", "dusseldorf"],
+    "Europe/Paris": ["lyon", "marseille", "toulouse", "nice"],
+    "Europe/Madrid": ["barcelona", "valencia", "seville"],
+    "Europe/Rome": ["milan", "naples", "turin", "florence", "venice"],
+    "Europe/Amsterdam": ["rotterdam", "the hague", "utrecht"],
+    "Europe/Warsaw": ["krakow", "wroclaw", "gdansk"],
+    "Asia/Kolkata": ["mumbai", "delhi", "new delhi", "bangalore", "bengaluru", "chennai", "hyderabad", "pune"],
+    "Asia/Shanghai": ["beijing", "shenzhen", "guangzhou", "chengdu", "wuhan"],
+    "Asia/Tokyo": ["osaka", "kyoto", "yokohama", "nagoya", "sapporo"],
+    "Asia/Seoul": ["busan", "incheon"],
+    "Asia/Ho_Chi_Minh": ["saigon", "hanoi"],
+    "Asia/Karachi": ["lahore", "islamabad"],
+    "Asia/Dubai": ["abu dhabi"],
+    "Australia/Sydney": ["canberra"],
+    "America/Sao_Paulo": ["rio de janeiro", "rio", "brasilia"],
+    "Africa/Lagos": ["abuja"],
+}
+
+# Zones used for UTC offsets which aren't a whole number of hours, keyed by offset in minutes
+# Only zones without DST, an offset has to stay the same all year like the Etc/GMT zones used for whole hours
+fractional_offsets = {
+    -570: "Pacific/Marquesas", 210: "Asia/Tehran", 270: "Asia/Kabul", 330: "Asia/Kolkata", 345: "Asia/Kathmandu",
+    390: "Asia/Yangon", 525: "Australia/Eucla", 570: "Australia/Darwin",
+}
+
+# Offsets only used by zones which shift for DST, these are rejected and the zone is suggested instead
+dst_offsets = {-210: "America/St_Johns", -150: "America/St_Johns", 630: "Australia/Lord_Howe",
+               765: "Pacific/Chatham", 825: "Pacific/Chatham"}
+
+# "utc+5", "gmt-3:30", "+0530", "utc + 10"
+offset_pattern = re.compile(r"^(?:utc|gmt)?\s*([+-])\s*(\d{1,2})(?::?(\d{2}))?$")
+
+# Index Setup ----------------------------------------------------------------------
+# Built by buildIndex on the first resolve
+names = None  # Normalized name --> zone
+trie = None  # Nested dicts keyed by character, the "" key of a node holds the zone of the name ending there
+
+
+# Resolver functions ---------------------------------------------------------------
+# Returns (zone, suggestions), zone is None if text doesn't resolve to a single zone,
+# suggestions then lists the closest zones
+def resolve(text):
+    if names is None:
+        buildIndex()
+    key = normalize(text)
+    if len(key) == 0:
+        return None, []
+
+    # Exact name, abbreviation or city
+    zone = names.get(key)
+    if zone is not None:
+        return zone, []
+
+    # UTC offset
+    match = offset_pattern.match(key)
+    if match is not None:
+        return offsetZone(match)
+
+    # Start of a name, resolved if every name starting with it is the same zone
+    node = findNode(key)
+    if node is not None:
+        zones = zonesUnder(node)
+        if len(zones) == 1 and len(key) >= RESOLVE_MIN_LENGTH:
+            return zones[0], []
+        return None, sortSuggestions(zones, key)
+
+    # Misspelled name, resolved if the closest names are all the same zone
+    # Too many zones are an edit or two away from a short word ("wat", "yo"), those are left unknown
+    if len(key) < RESOLVE_MIN_LENGTH:
+        return None, []
+    distance = FUZZY_DISTANCE if len(key) >= FUZZY_MIN_LENGTH else 1
+    matches = fuzzyMatches(key, distance)
+    if len(matches) == 0:
+        return None, []
+    best = min(matches.values())
+    closest = sorted({zone for zone, found in matches.items() if found == best})
+    if len(closest) == 1:
+        return closest[0], []
+    return None, closest[:MAX_SUGGESTIONS]
+
+
+# Lowercase, underscores and repeated spaces become single spaces
+def normalize(text):
+    return " ".join(text.lower().replace("_", " ").split())
+
+
+# Builds the name index and trie from every pytz zone plus the alias and city tables
+def buildIndex():
+    global names, trie
+    start = time.perf_counter()
+    index = {}
+
+    # Full zone names first, then their cities, common zones before backward compatible ones
+    for zone in pytz.all_timezones:
+        index[normalize(zone)] = zone
+    for zone in list(pytz.common_timezones) + list(pytz.all_timezones):
+        if "/" not in zone or zone.startswith("Etc/"):
+            continue
+        city = normalize(zone.rsplit("/", 1)[1])
+        if city not in index:
+            index[city] = zone
+
+    for table in (city_zones, zone_aliases):
+        for zone, aliases in table.items():
+            for alias in aliases:
+                index[alias] = zone
+
+    root = {}
+    for name, zone in index.items():
+        node = root
+        for character in name:
+            node = node.setdefault(character, {})
+        node[""] = zone
+
+    names = index
+    trie = root
+    logging.info("Built timezone index with %s names in %.1f ms", len(names), (time.perf_counter() - start) * 1e3)
+
+
+# (zone, suggestions) for a UTC offset, Etc/GMT zones use the opposite sign (Etc/GMT-5 is UTC+5)
+def offsetZone(match):
+    sign = 1 if match.group(1) == "+" else -1
+    hours = int(match.group(2))
+    minutes = int(match.group(3) or 0)
+    if hours > 14 or minutes > 59:
+        return None, []
+    if minutes == 0:
+        if hours == 0:
+            return "UTC", []
+        return "Etc/GMT{}{}".format("-" if sign > 0 else "+", hours), []
+    offset = sign * (hours * 60 + minutes)
+    if offset in dst_offsets:
+        return None, [dst_offsets[offset]]
+    return fractional_offsets.get(offset), []
+
+
+def findNode(key):
+    node = trie
+    for character in key:
+        node = node.get(character)
+        if node is None:
+            return None
+    return node
+
+
+# Every distinct zone of the names below node
+def zonesUnder(node):
+    zones = set()
+    stack = [node]
+    while len(stack) != 0:
+        node = stack.pop()
+        for character, child in node.items():
+            if character == "":
+                zones.add(child)
+            else:
+                stack.append(child)
+    return sorted(zones)
+
+
+# Shortest zone names first, they are usually the ones meant
+def sortSuggestions(zones, key):
+    return sorted(zones, key=lambda zone: (not normalize(zone).startswith(key), len(zone), zone))[:MAX_SUGGESTIONS]
+
+
+# Zones of every name within maxDistance edits of key, zone --> smallest distance
+# Walks the trie carrying one row of the edit distance table per node, branches which can't get close enough are skipped
+def fuzzyMatches(key, maxDistance):
+    matches = {}
+    firstRow = list(range(len(key) + 1))
+    stack = [(child, character, firstRow) for character, child in trie.items() if character != ""]
+    while len(stack) != 0:
+        node, character, previousRow = stack.pop()
+        row = [previousRow[0] + 1]
+        for column in range(1, len(key) + 1):
+            row.append(min(row[column - 1] + 1, previousRow[column] + 1,
+                           previousRow[column - 1] + (key[column - 1] != character)))
+
+        zone = node.get("")
+        if zone is not None and row[-1] <= maxDistance:
+            matches[zone] = min(matches.get(zone, row[-1]), row[-1])
+        if min(row) <= maxDistance:
+            stack.extend((child, nextCharacter, row) for nextCharacter, child in node.items() if nextCharacter != "")
+    return matches
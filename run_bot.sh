@@ -31,7 +31,12 @@ if [ $IS_ONLINE -eq 0 ]; then
     exit 1
 fi
 
-# Start the bot
-(cd /root/RealTimeBot && python3 RealTimeBot.py) &
+# Start the bot, WORKERS=N runs N sharded worker processes supervised by launcher.py, which restarts any that crash
+WORKERS=${WORKERS:-0}
+if [ $WORKERS -gt 0 ]; then
+    (cd /root/RealTimeBot && python3 launcher.py --workers $WORKERS) &
+else
+    (cd /root/RealTimeBot && python3 RealTimeBot.py) &
+fi
 echo "run_bot.sh succeeded, bot has been initialized"
-ps -aux | grep "RealTimeBot.py"
+ps -aux | grep "RealTimeBot.py\|launcher.py"
@@ -0,0 +1,622 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import contextlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# orjson parses and serializes several times faster, the standard library is used when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Settings -------------------------------------------------------------------------
+GUILDS_FILE = "guilds.json"  # File guilds are loaded from and saved to by the json backend
+SQLITE_FILE = "guilds.db"  # Database used by the sqlite backend
+SAVE_INTERVAL = 10  # Seconds between json writes, changes made in between are coalesced into one write
+SQLITE_TIMEOUT = 5  # Seconds a write waits for another process holding the database lock
+# sqlite writes run on the event loop, a write waiting for the lock blocks every shard of the worker that long
+SQLITE_SLOW_LOCK = 0.5  # Seconds of waiting for the lock past which a warning is logged
+INACTIVE_TTL = 90  # Days an inactive record without a timezone is kept after its user was last seen
+
+# Single worker so json writes never overlap
+save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+
+# Zone table of the json backend, users hold an index into zone_names instead of the zone string
+zone_names = [None]  # Zone ID --> zone, 0 is an unset timezone
+zone_ids = {None: 0}  # Zone --> zone ID
+
+# guilds.json notes:
+# Written with the version and then one guild per line so a guild can be found without parsing the rest,
+# older files written on a single line are still read
+# Outermost level: Guild IDs
+# Next level: "timezones", "users" and optionally "words" and "seen"
+# timezones --> contains all server timezones which need to be displayed
+# words --> the guild's changes to the detection word lists, see detection.compileWords
+# seen --> User ID --> day (days since the epoch) the user was last seen, only for records with no timezone
+#          which are inactive, these are removed once unseen for INACTIVE_TTL days, see compactGuild
+# users --> User IDs
+# Next level: "timezone" and "active"
+# timezone --> User's timezone
+# active --> User's opt-in/opt-out status, boolean
+# In memory a decoded guild's users are int user ID --> packed record, see packUser
+
+# guilds.db notes:
+# users --> one row per (guild_id, user_id) with timezone and active, the same fields as guilds.json,
+#           and last_seen, the same as seen in guilds.json
+# guild_timezones --> derived from users, the timezones which need to be displayed for each guild
+#                     and the number of active users in each
+# guilds --> every guild the bot has joined, meta --> version
+# guild_config --> per guild settings, words holds the guild's word list changes as JSON
+# Sharded workers (see launcher.py) share one database, each guild belongs to a single shard so a worker
+# only ever writes the users of its own guilds and its guild_timezones cache can't go stale
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS guilds (guild_id TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS users (guild_id TEXT NOT NULL, user_id TEXT NOT NULL, timezone TEXT, active INTEGER NOT NULL,
+                                  last_seen INTEGER);
+CREATE UNIQUE INDEX IF NOT EXISTS users_guild_user ON users (guild_id, user_id);
+CREATE TABLE IF NOT EXISTS guild_timezones (guild_id TEXT NOT NULL, timezone TEXT NOT NULL, users INTEGER NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS guild_timezones_guild_zone ON guild_timezones (guild_id, timezone);
+CREATE TABLE IF NOT EXISTS guild_config (guild_id TEXT PRIMARY KEY, words TEXT);
+"""
+
+
+# Waits for the writes still running in save_executor, for use after the event loop has stopped
+# A write whose task was cancelled keeps running in its thread, a synchronous write before it ends could be replaced
+# by that older snapshot. Nothing can be saved in the background afterwards
+def finishSaves():
+    save_executor.shutdown(wait=True)
+
+
+# Returns the storage backend named by backend, "json" or "sqlite"
+def openStorage(backend):
+    if backend == "json":
+        return JsonStorage()
+    elif backend == "sqlite":
+        return SqliteStorage()
+    raise ValueError("Unknown storage backend: {}".format(backend))
+
+
+# JSON helpers, bytes in and out whichever parser is used
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode("utf-8")
+
+
+# Json backend user records are packed into one int, zone ID * 2 + active
+# Small ints are shared by the interpreter, so a record costs nothing beyond its slot in the users dict
+def packUser(zone, active):
+    zoneID = zone_ids.get(zone)
+    if zoneID is None:
+        zoneID = zone_ids[zone] = len(zone_names)
+        zone_names.append(zone)
+    return zoneID << 1 | bool(active)
+
+
+# Returns (timezone, active) of a packed record
+def unpackUser(record):
+    return zone_names[record >> 1], bool(record & 1)
+
+
+# Returns the zone a packed user record counts towards, None for missing, inactive and unset records
+def activeZone(record):
+    if record is None or not record & 1:
+        return None
+    return zone_names[record >> 1]
+
+
+# Bytes a removed inactive record took in guilds.json, how much compaction reports reclaiming for both backends
+def recordBytes(userID):
+    return len(dumps({str(userID): {"timezone": None, "active": False}})) - 1
+
+
+# Today in days since the epoch, what last seen days are counted in
+def today():
+    return int(time.time() // 86400)
+
+
+# Storage backends -------------------------------------------------------------------------
+# Both backends take string guild IDs and string or int user IDs, and return user records as (timezone, active)
+# A guild's timezones are the zones of its active users, kept as refcounts and updated with each change
+# Changes are synchronous calls on the event loop so they never interleave with each other
+
+# Keeps everything in one dict and writes the whole guilds.json behind changes
+# Guilds are decoded on first use, until then data holds the guild's bytes from guilds.json
+# Writes serialize a snapshot in save_executor, guild records are copied on write while a snapshot may hold them
+class JsonStorage:
+    def __init__(self, path=None):
+        self.path = GUILDS_FILE if path is None else path
+        self.data = {}  # "version" and guild ID --> guild record, or its undecoded bytes
+        self.dirty = False  # Set when data has changed since the last write
+        self.lock = asyncio.Lock()  # Held while a snapshot is taken and written, writes never overlap
+        self.snapshotVersion = 0  # Snapshots taken so far
+        self.ownedVersion = {}  # Guild ID --> snapshotVersion its record was created at, older records are shared
+        self.last_save = 0  # Time of the last completed write
+        self.zoneCounts = {}  # Guild ID --> {zone: number of active users in that zone}, only for guilds in use
+        self.timezonesChanged = None  # Called with (guild ID, previous timezones) when a guild's timezones change
+
+    def load(self):
+        with open(self.path, 'rb') as file:
+            content = file.read()
+
+        self.data = self.splitGuilds(content)
+        if self.data is None:
+            # Not written one guild per line, parse the whole file
+            self.data = loads(content)
+        self.zoneCounts = {}
+        self.ownedVersion = {}
+
+    # Splits a file written by serialize into "version" and guild ID --> guild bytes, None for any other layout
+    def splitGuilds(self, content):
+        lines = content.split(b"\n")
+        if len(lines) < 2 or not lines[0].startswith(b'{"version":') or lines[-1] != b"}":
+            return None
+
+        data = loads(lines[0].rstrip(b",") + b"}")
+        for line in lines[1:-1]:
+            keyEnd = line.find(b'": ')
+            guild = line[keyEnd + 3:].rstrip(b",")
+            if not line.startswith(b'"') or keyEnd == -1 or not guild.startswith(b"{") or not guild.endswith(b"}"):
+                return None
+            data[loads(line[:keyEnd + 1])] = guild
+        return data
+
+    # Returns a guild's record for reading, decoding it, packing its users and counting its zones the first time it is used
+    # The record is a new dict, one parsed from a single line file may be held by a snapshot
+    def guild(self, guildID):
+        if guildID not in self.zoneCounts:
+            guild = self.data[guildID]
+            guild = dict(loads(guild) if isinstance(guild, bytes) else guild)
+            guild["users"] = {int(userID): packUser(user["timezone"], user["active"]) for userID, user in guild["users"].items()}
+            if "seen" in guild:
+                guild["seen"] = {int(userID): day for userID, day in guild["seen"].items()}
+            self.data[guildID] = guild
+            self.ownedVersion[guildID] = self.snapshotVersion
+            self.countZones(guildID)
+        return self.data[guildID]
+
+    # Returns a guild's record for changing it, copying it first if a snapshot taken since it was created holds it
+    # Only the containers changes are made in are copied, timezones and words are always replaced rather than changed
+    def writableGuild(self, guildID):
+        guild = self.guild(guildID)
+        if self.ownedVersion[guildID] != self.snapshotVersion:
+            guild = dict(guild)
+            guild["users"] = dict(guild["users"])
+            if "seen" in guild:
+                guild["seen"] = dict(guild["seen"])
+            self.data[guildID] = guild
+            self.ownedVersion[guildID] = self.snapshotVersion
+        return guild
+
+    # A decoded guild record in the guilds.json layout, with string user IDs and unpacked records
+    @staticmethod
+    def exportGuild(guild):
+        guild = dict(guild)
+        guild["users"] = {str(userID): {"timezone": zone_names[record >> 1], "active": bool(record & 1)}
+                          for userID, record in guild["users"].items()}
+        if "seen" in guild:
+            guild["seen"] = {str(userID): day for userID, day in guild["seen"].items()}
+        return guild
+
+    def version(self):
+        return str(self.data["version"])
+
+    def guildIDs(self):
+        return [guildID for guildID in self.data if guildID != "version"]
+
+    def hasGuild(self, guildID):
+        return guildID in self.data
+
+    def addGuild(self, guildID):
+        self.data[guildID] = {"timezones": [], "users": {}}
+        self.zoneCounts[guildID] = {}
+        self.ownedVersion[guildID] = self.snapshotVersion
+        self.markDirty()
+
+    # Drops a guild and every user record in it, returns the number of users removed
+    def removeGuild(self, guildID):
+        users = len(self.guild(guildID)["users"])
+        del self.data[guildID]
+        del self.zoneCounts[guildID]
+        del self.ownedVersion[guildID]
+        self.markDirty()
+        return users
+
+    def getUser(self, guildID, userID):
+        record = self.guild(guildID)["users"].get(int(userID))
+        if record is None:
+            return None
+        return zone_names[record >> 1], bool(record & 1)
+
+    def setTimezone(self, guildID, userID, zone):
+        self.changeUser(guildID, userID, packUser(zone, True))
+
+    def setActive(self, guildID, userID, active):
+        record = self.guild(guildID)["users"][int(userID)]
+        self.changeUser(guildID, userID, record & ~1 | bool(active))
+
+    def removeUser(self, guildID, userID):
+        self.changeUser(guildID, userID, None)
+
+    # Records the day an inactive user without a timezone was seen, other records never expire
+    def touchUser(self, guildID, userID, day):
+        userID = int(userID)
+        guild = self.guild(guildID)
+        if guild["users"].get(userID) != 0 or guild.get("seen", {}).get(userID) == day:
+            return
+        self.writableGuild(guildID).setdefault("seen", {})[userID] = day
+        self.markDirty()
+
+    # Removes the inactive records without a timezone unseen since before cutoff (a day), records which were never
+    # seen are stamped with day first. Returns the removed user IDs, guilds not decoded before are encoded again after
+    def compactGuild(self, guildID, cutoff, day):
+        decoded = guildID in self.zoneCounts
+        guild = self.writableGuild(guildID)
+        users = guild["users"]
+        seen = guild.setdefault("seen", {})
+        changed = False
+        removed = []
+        for userID, record in users.items():
+            if record != 0:
+                continue
+            lastSeen = seen.get(userID)
+            if lastSeen is None:
+                seen[userID] = day
+                changed = True
+            elif lastSeen < cutoff:
+                removed.append(userID)
+        for userID in removed:
+            del users[userID]
+            del seen[userID]
+        if len(seen) == 0:
+            del guild["seen"]
+
+        if changed or len(removed) != 0:
+            self.markDirty()
+        if not decoded:
+            self.data[guildID] = dumps(self.exportGuild(guild))
+            del self.zoneCounts[guildID]
+            del self.ownedVersion[guildID]
+        return removed
+
+    def getTimezones(self, guildID):
+        return self.guild(guildID)["timezones"]
+
+    # Word list changes of a guild, None if it uses the defaults
+    def getWords(self, guildID):
+        return self.guild(guildID).get("words")
+
+    def setWords(self, guildID, words):
+        guild = self.writableGuild(guildID)
+        if words:
+            guild["words"] = words
+        else:
+            guild.pop("words", None)
+        self.markDirty()
+
+    # Replaces a user's packed record and moves the user between zone refcounts, O(1) in the number of users
+    # A record of None removes the user
+    def changeUser(self, guildID, userID, record):
+        userID = int(userID)
+        guild = self.writableGuild(guildID)
+        users = guild["users"]
+        previousZone = activeZone(users.get(userID))
+        if record is None:
+            users.pop(userID, None)
+        else:
+            users[userID] = record
+        if record != 0 and "seen" in guild:
+            guild["seen"].pop(userID, None)
+        if previousZone != activeZone(record):
+            self.countZone(guildID, previousZone, -1)
+            self.countZone(guildID, activeZone(record), 1)
+        self.markDirty()
+
+    # Adds change to the refcount of zone, adding or removing it from the guild's timezones when needed
+    def countZone(self, guildID, zone, change):
+        if zone is None:
+            return
+        counts = self.zoneCounts[guildID]
+        count = counts.get(zone, 0) + change
+        previous = self.data[guildID]["timezones"]
+
+        if count > 0:
+            if zone not in counts:
+                self.data[guildID]["timezones"] = previous + [zone]
+            counts[zone] = count
+        else:
+            del counts[zone]
+            self.data[guildID]["timezones"] = [timezone for timezone in previous if timezone != zone]
+
+        if self.data[guildID]["timezones"] is not previous and self.timezonesChanged is not None:
+            self.timezonesChanged(guildID, previous)
+
+    # Builds the zone refcounts of a guild from its users
+    def countZones(self, guildID):
+        counts = {}
+        for record in self.data[guildID]["users"].values():
+            zone = activeZone(record)
+            if zone is not None:
+                counts[zone] = counts.get(zone, 0) + 1
+        self.zoneCounts[guildID] = counts
+        self.data[guildID]["timezones"] = list(counts)
+
+    # Flags data for the next write
+    def markDirty(self):
+        self.dirty = True
+
+    # Copy of data for serializing in another thread, [(guild ID, record or bytes, whether the record is packed)]
+    # Only the references are copied, every record it holds is copied by writableGuild before it changes
+    def snapshot(self):
+        self.snapshotVersion += 1
+        return [(guildID, guild, guildID in self.zoneCounts) for guildID, guild in self.data.items()]
+
+    # Serializes a snapshot one guild per line, guilds which were never decoded are written back unchanged
+    def serialize(self, snapshot=None):
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        parts = []
+        for guildID, guild, packed in snapshot:
+            if guildID == "version":
+                parts.insert(0, b'{"version": ' + dumps(guild))
+            elif isinstance(guild, bytes):
+                parts.append(dumps(guildID) + b": " + guild)
+            else:
+                parts.append(dumps(guildID) + b": " + dumps(self.exportGuild(guild) if packed else guild))
+        return b",\n".join(parts) + b"\n}"
+
+    # Writes data to the file atomically, a crash mid-write leaves the previous file in place
+    def writeFile(self, data):
+        temp = self.path + ".tmp"
+        with open(temp, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.path)
+        self.last_save = time.time()
+
+    # Writes data if it has changed, serializing and writing run in save_executor so the event loop isn't blocked
+    async def flush(self):
+        async with self.lock:
+            if not self.dirty:
+                return
+
+            # The snapshot is taken on the loop, changes made while it is written go to copied records
+            self.dirty = False
+            snapshot = self.snapshot()
+            try:
+                await asyncio.get_event_loop().run_in_executor(save_executor, self.writeSnapshot, snapshot)
+            except Exception:
+                self.dirty = True
+                logging.exception("An error occurred while saving %s", self.path)
+                return
+        logging.debug("Saved %s", self.path)
+
+    def writeSnapshot(self, snapshot):
+        self.writeFile(self.serialize(snapshot))
+
+    # Synchronous flush for use after the event loop has stopped
+    def flushNow(self):
+        finishSaves()
+        if not self.dirty:
+            return
+        self.dirty = False
+        self.writeFile(self.serialize())
+        logging.info("Saved %s on shutdown", self.path)
+
+    # Background task, writes at most once every SAVE_INTERVAL seconds
+    async def saveLoop(self):
+        while True:
+            await asyncio.sleep(SAVE_INTERVAL)
+            await self.flush()
+
+
+# Keeps users in an indexed SQLite table, every change is a single row upsert committed on its own
+class SqliteStorage:
+    def __init__(self, path=None):
+        self.path = SQLITE_FILE if path is None else path
+        self.connection = None
+        self.timezones = {}  # guild_timezones cache, guild ID --> list of zones
+        self.last_save = 0  # Time of the last committed change
+        self.timezonesChanged = None  # Called with (guild ID, previous timezones) when a guild's timezones change
+
+    def load(self):
+        self.connection = sqlite3.connect(self.path, isolation_level=None, timeout=SQLITE_TIMEOUT)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        # Databases from before refcounting have no users column, rebuild the table from users
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(guild_timezones)")]
+        if len(columns) != 0 and "users" not in columns:
+            self.connection.execute("DROP TABLE guild_timezones")
+            self.connection.executescript(SQLITE_SCHEMA)
+            self.countZones()
+
+        self.connection.executescript(SQLITE_SCHEMA)
+        self.connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '2.0')")
+
+        # Databases from before compaction have no last_seen column
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(users)")]
+        if "last_seen" not in columns:
+            self.connection.execute("ALTER TABLE users ADD COLUMN last_seen INTEGER")
+        self.timezones = {}
+
+    # Runs the statements of a with block in one transaction, rolled back if any of them raises so the connection
+    # never stays inside a transaction holding the write lock
+    @contextlib.contextmanager
+    def transaction(self, begin="BEGIN IMMEDIATE"):
+        start = time.perf_counter()
+        self.connection.execute(begin)
+        waited = time.perf_counter() - start
+        if waited > SQLITE_SLOW_LOCK:
+            logging.warning("Waited %.2f seconds for the %s write lock, the event loop was blocked meanwhile", waited, self.path)
+        try:
+            yield
+            self.connection.execute("COMMIT")
+        except BaseException:
+            if self.connection.in_transaction:
+                self.connection.execute("ROLLBACK")
+            raise
+
+    def version(self):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return None if row is None else row[0]
+
+    def guildIDs(self):
+        return [row[0] for row in self.connection.execute("SELECT guild_id FROM guilds")]
+
+    def hasGuild(self, guildID):
+        return self.connection.execute("SELECT 1 FROM guilds WHERE guild_id = ?", (guildID,)).fetchone() is not None
+
+    def addGuild(self, guildID):
+        self.execute("INSERT OR IGNORE INTO guilds (guild_id) VALUES (?)", (guildID,))
+
+    # Drops a guild and every user record in it, returns the number of users removed
+    def removeGuild(self, guildID):
+        with self.transaction():
+            users = self.connection.execute("DELETE FROM users WHERE guild_id = ?", (guildID,)).rowcount
+            for table in ("guild_timezones", "guild_config", "guilds"):
+                self.connection.execute("DELETE FROM {} WHERE guild_id = ?".format(table), (guildID,))
+        self.timezones.pop(guildID, None)
+        self.last_save = time.time()
+        return users
+
+    def getUser(self, guildID, userID):
+        row = self.connection.execute("SELECT timezone, active FROM users WHERE guild_id = ? AND user_id = ?",
+                                      (guildID, userID)).fetchone()
+        if row is None:
+            return None
+        return row[0], bool(row[1])
+
+    def setTimezone(self, guildID, userID, zone):
+        self.changeUser(guildID, userID, zone, True,
+                        "INSERT INTO users (guild_id, user_id, timezone, active) VALUES (?, ?, ?, 1) "
+                        "ON CONFLICT (guild_id, user_id) DO UPDATE SET timezone = excluded.timezone, active = 1",
+                        (guildID, userID, zone))
+
+    def setActive(self, guildID, userID, active):
+        user = self.getUser(guildID, userID)
+        self.changeUser(guildID, userID, None if user is None else user[0], active,
+                        "UPDATE users SET active = ? WHERE guild_id = ? AND user_id = ?", (int(active), guildID, userID))
+
+    def removeUser(self, guildID, userID):
+        self.changeUser(guildID, userID, None, False, "DELETE FROM users WHERE guild_id = ? AND user_id = ?", (guildID, userID))
+
+    # Records the day an inactive user without a timezone was seen, other records never expire
+    def touchUser(self, guildID, userID, day):
+        self.execute("UPDATE users SET last_seen = ? WHERE guild_id = ? AND user_id = ? AND timezone IS NULL AND active = 0 "
+                     "AND (last_seen IS NULL OR last_seen < ?)", (day, guildID, userID, day))
+
+    # Removes the inactive records without a timezone unseen since before cutoff (a day), records which were never
+    # seen are stamped with day first. Returns the removed user IDs
+    def compactGuild(self, guildID, cutoff, day):
+        with self.transaction():
+            self.connection.execute("UPDATE users SET last_seen = ? WHERE guild_id = ? AND timezone IS NULL AND active = 0 "
+                                    "AND last_seen IS NULL", (day, guildID))
+            condition = "WHERE guild_id = ? AND timezone IS NULL AND active = 0 AND last_seen < ?"
+            removed = [row[0] for row in self.connection.execute("SELECT user_id FROM users " + condition, (guildID, cutoff))]
+            self.connection.execute("DELETE FROM users " + condition, (guildID, cutoff))
+        self.last_save = time.time()
+        return removed
+
+    # Runs a single row change to a user and moves the user between zone refcounts in the same transaction
+    # zone and active describe the user after the change
+    # The write lock is taken before the user is read so another process can't change the row in between
+    def changeUser(self, guildID, userID, zone, active, statement, parameters):
+        zone = zone if active else None
+
+        with self.transaction():
+            previous = self.getUser(guildID, userID)
+            previousZone = previous[0] if previous is not None and previous[1] else None
+            self.connection.execute(statement, parameters)
+            if previousZone != zone:
+                if previousZone is not None:
+                    self.connection.execute("UPDATE guild_timezones SET users = users - 1 WHERE guild_id = ? AND timezone = ?",
+                                            (guildID, previousZone))
+                    self.connection.execute("DELETE FROM guild_timezones WHERE guild_id = ? AND timezone = ? AND users <= 0",
+                                            (guildID, previousZone))
+                if zone is not None:
+                    self.connection.execute("INSERT INTO guild_timezones (guild_id, timezone, users) VALUES (?, ?, 1) "
+                                            "ON CONFLICT (guild_id, timezone) DO UPDATE SET users = users + 1",
+                                            (guildID, zone))
+        self.last_save = time.time()
+
+        if previousZone != zone:
+            timezones = self.getTimezones(guildID)
+            del self.timezones[guildID]
+            if timezones != self.getTimezones(guildID) and self.timezonesChanged is not None:
+                self.timezonesChanged(guildID, timezones)
+
+    def getTimezones(self, guildID):
+        timezones = self.timezones.get(guildID)
+        if timezones is None:
+            timezones = [row[0] for row in self.connection.execute(
+                "SELECT timezone FROM guild_timezones WHERE guild_id = ? ORDER BY rowid", (guildID,))]
+            self.timezones[guildID] = timezones
+        return timezones
+
+    def getWords(self, guildID):
+        row = self.connection.execute("SELECT words FROM guild_config WHERE guild_id = ?", (guildID,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def setWords(self, guildID, words):
+        self.execute("INSERT INTO guild_config (guild_id, words) VALUES (?, ?) "
+                     "ON CONFLICT (guild_id) DO UPDATE SET words = excluded.words",
+                     (guildID, json.dumps(words) if words else None))
+
+    # Rebuilds every guild's zone refcounts from users, only used when importing or upgrading a database
+    def countZones(self):
+        self.connection.execute("DELETE FROM guild_timezones")
+        self.connection.execute("INSERT INTO guild_timezones (guild_id, timezone, users) "
+                                "SELECT guild_id, timezone, COUNT(*) FROM users WHERE active = 1 AND timezone IS NOT NULL "
+                                "GROUP BY guild_id, timezone ORDER BY MIN(rowid)")
+        self.timezones = {}
+
+    def execute(self, statement, parameters):
+        self.connection.execute(statement, parameters)
+        self.last_save = time.time()
+
+    # Imports an existing guilds.json (version 2.0) in a single transaction
+    def importJson(self, path):
+        with open(path, 'r') as file:
+            data = json.load(file)
+        if str(data.get("version")) != "2.0":
+            raise ValueError("{} is version {}, only version 2.0 can be imported".format(path, data.get("version")))
+
+        with self.transaction("BEGIN"):
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(data["version"]),))
+            for guildID, guild in data.items():
+                if guildID == "version":
+                    continue
+                self.connection.execute("INSERT OR IGNORE INTO guilds (guild_id) VALUES (?)", (guildID,))
+                seen = guild.get("seen", {})
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO users (guild_id, user_id, timezone, active, last_seen) VALUES (?, ?, ?, ?, ?)",
+                    [(guildID, userID, user["timezone"], int(user["active"]), seen.get(userID))
+                     for userID, user in guild["users"].items()])
+                if guild.get("words"):
+                    self.connection.execute("INSERT OR REPLACE INTO guild_config (guild_id, words) VALUES (?, ?)",
+                                            (guildID, json.dumps(guild["words"])))
+            self.countZones()
+
+    # Every change is already committed, nothing is written behind
+    async def flush(self):
+        pass
+
+    def flushNow(self):
+        pass
+
+    async def saveLoop(self):
+        pass
@@ -0,0 +1,137 @@
+import time
+import datetime
+import logging
+import pytz
+from bisect import bisect_right, insort
+
+# Settings -------------------------------------------------------------------------
+TABLE_YEARS = 5  # Years of UTC transitions kept after the tables are built
+TABLE_HISTORY_DAYS = 7  # Days of transitions kept before the tables are built, covers slightly old messages
+
+# Transition Table Setup -------------------------------------------------------------------
+# Per zone offset tables, zone --> (starts, offsets, dsts)
+# starts: UTC epoch seconds at which each entry comes into force, the first entry covers everything before it
+# offsets: UTC offset in seconds, dsts: True if the entry is daylight saving time
+zone_tables = {}
+
+# Every transition of every loaded zone, sorted, no loaded zone changes offset between two neighbours
+period_bounds = []
+
+# Bumped whenever a zone is loaded and period_bounds changes
+table_version = 0
+
+# Range covered by the tables, timestamps outside it fall back to pytz
+table_start = 0
+table_end = 0
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+# Table functions --------------------------------------------------------------------------
+# Builds the tables for every zone in zones, called at startup with every zone in use
+def buildTables(zones):
+    for zone in zones:
+        if zone not in zone_tables:
+            loadZone(zone)
+
+
+# Builds the table for a single zone from the pytz transition data
+def loadZone(zone):
+    global table_version, table_start, table_end
+
+    if table_end == 0:
+        now = int(time.time())
+        table_start = now - TABLE_HISTORY_DAYS * 86400
+        table_end = now + TABLE_YEARS * 366 * 86400
+
+    tz = pytz.timezone(zone)
+    transitions = getattr(tz, "_utc_transition_times", None)
+    if transitions is None:
+        # Fixed offset zones such as UTC and Etc/GMT+5
+        offset = tz.utcoffset(datetime.datetime(2000, 1, 1))
+        zone_tables[zone] = ([table_start], [int(offset.total_seconds())], [False])
+    else:
+        starts = [int((transition - EPOCH).total_seconds()) for transition in transitions]
+        first = max(0, bisect_right(starts, table_start) - 1)
+        last = bisect_right(starts, table_end)
+
+        starts = starts[first:last]
+        starts[0] = table_start
+        offsets = [int(info[0].total_seconds()) for info in tz._transition_info[first:last]]
+        dsts = [bool(info[1]) for info in tz._transition_info[first:last]]
+        zone_tables[zone] = (starts, offsets, dsts)
+
+        for start in starts[1:]:
+            if start not in period_bounds:
+                insort(period_bounds, start)
+
+    table_version += 1
+    logging.debug("Built transition table for %s with %s entries", zone, len(zone_tables[zone][0]))
+
+
+# Returns the table entry index in force at timestamp, None if the timestamp is outside the tables
+def entryAt(zone, timestamp):
+    if zone not in zone_tables:
+        loadZone(zone)
+    if timestamp < table_start or timestamp >= table_end:
+        return None
+    return bisect_right(zone_tables[zone][0], timestamp) - 1
+
+
+# Returns the UTC offset in seconds of zone at timestamp, None if the timestamp is outside the tables
+def offsetAt(zone, timestamp):
+    index = entryAt(zone, timestamp)
+    if index is None:
+        return None
+    return zone_tables[zone][1][index]
+
+
+# Returns the wall time of zone at timestamp as a naive datetime
+def localTime(zone, timestamp):
+    offset = offsetAt(zone, timestamp)
+    if offset is None:
+        return datetime.datetime.fromtimestamp(timestamp, pytz.utc).astimezone(pytz.timezone(zone)).replace(tzinfo=None)
+    return EPOCH + datetime.timedelta(seconds=timestamp + offset)
+
+
+# Returns the start of the period containing timestamp, every loaded zone keeps one offset within a period
+def periodAt(timestamp):
+    index = bisect_right(period_bounds, timestamp) - 1
+    if index < 0:
+        return table_start
+    return period_bounds[index]
+
+
+# Returns the UTC timestamp of a wall time, local is seconds since the epoch in the zone's local time
+# Matches pytz localize(is_dst=False): ambiguous times use standard time and times skipped
+# by a transition are read with the offset in force before it
+# Returns None if the time is outside the tables
+def localToUTC(zone, local):
+    table = zone_tables.get(zone)
+    if table is None:
+        loadZone(zone)
+        table = zone_tables[zone]
+
+    # Offsets are at most a day away from UTC, any offset that could apply is in force within a day of local
+    first = entryAt(zone, local - 86400)
+    last = entryAt(zone, local + 86400)
+    if first is None or last is None:
+        return None
+
+    candidates = []
+    for index in range(first, last + 1):
+        offset = table[1][index]
+        if offsetAt(zone, local - offset) == offset:
+            candidates.append((local - offset, table[2][index]))
+
+    if len(candidates) == 0:
+        # Skipped time, resolve six hours earlier and step forward
+        resolved = localToUTC(zone, local - 21600)
+        return None if resolved is None else resolved + 21600
+
+    if len(candidates) > 1:
+        standard = [candidate for candidate in candidates if not candidate[1]]
+        if len(standard) != 0:
+            candidates = standard
+
+    return min(candidates)[0]
@@ -0,0 +1,122 @@
+import os
+import math
+import asyncio
+import hashlib
+import logging
+import storage
+
+# Remembers which users have been sent the welcome message in each guild, in a Bloom filter instead of a user record
+# A false positive means a user is never welcomed in that guild, at WELCOMED_ERROR that is one in a thousand
+
+# Settings -------------------------------------------------------------------------
+WELCOMED_FILE = "welcomed.bin"  # Where the filter is saved
+WELCOMED_CAPACITY = 2000000  # Welcomes the filter is sized for, false positives grow past this (3.4 MB at 2M)
+WELCOMED_ERROR = 0.001  # False positive rate at capacity
+
+
+# Bloom filter over byte strings, positions come from one blake2b digest by double hashing
+class BloomFilter:
+    def __init__(self, capacity, error):
+        self.size = int(-capacity * math.log(error) / math.log(2) ** 2)  # Bits
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0  # Items added, an estimate since repeats of a false positive aren't counted
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, item):
+        added = False
+        for position in self.positions(item):
+            if not self.bits[position >> 3] & 1 << (position & 7):
+                self.bits[position >> 3] |= 1 << (position & 7)
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & 1 << (position & 7) for position in self.positions(item))
+
+    # Header of size, hashes and count, then the bits
+    def serialize(self):
+        header = b"%d %d %d\n" % (self.size, self.hashes, self.count)
+        return header + bytes(self.bits)
+
+    def deserialize(self, data):
+        header, bits = data.split(b"\n", 1)
+        size, hashes, count = (int(value) for value in header.split())
+        if len(bits) != (size + 7) // 8:
+            raise ValueError("Filter is {} bytes, its header says {} bits".format(len(bits), size))
+        self.size, self.hashes, self.count = size, hashes, count
+        self.bits = bytearray(bits)
+
+
+# Welcome Setup --------------------------------------------------------------------
+welcomed = BloomFilter(WELCOMED_CAPACITY, WELCOMED_ERROR)
+dirty = False  # Set when welcomed has changed since the last write
+
+
+# Welcome functions ----------------------------------------------------------------
+def key(guildID, userID):
+    return "{}:{}".format(guildID, userID).encode()
+
+
+def isWelcomed(guildID, userID):
+    return key(guildID, userID) in welcomed
+
+
+def markWelcomed(guildID, userID):
+    global dirty
+    if welcomed.add(key(guildID, userID)):
+        dirty = True
+        if welcomed.count == WELCOMED_CAPACITY:
+            logging.warning("%s welcomed users, the filter's false positive rate is now above %s", welcomed.count, WELCOMED_ERROR)
+
+
+# Loads the filter saved in WELCOMED_FILE, a missing file leaves it empty
+def load():
+    if not os.path.exists(WELCOMED_FILE):
+        return
+    with open(WELCOMED_FILE, 'rb') as file:
+        welcomed.deserialize(file.read())
+    logging.info("Loaded %s welcomed users from %s", welcomed.count, WELCOMED_FILE)
+
+
+def writeFile(data):
+    temp = WELCOMED_FILE + ".tmp"
+    with open(temp, 'wb') as file:
+        file.write(data)
+    os.replace(temp, WELCOMED_FILE)
+
+
+# Writes the filter if it has changed, in the storage save thread
+async def flush():
+    global dirty
+    if not dirty:
+        return
+    dirty = False
+    try:
+        await asyncio.get_event_loop().run_in_executor(storage.save_executor, writeFile, welcomed.serialize())
+    except Exception:
+        dirty = True
+        logging.exception("An error occurred while saving %s", WELCOMED_FILE)
+
+
+# Synchronous flush for use after the event loop has stopped
+def flushNow():
+    global dirty
+    storage.finishSaves()
+    if dirty:
+        dirty = False
+        writeFile(welcomed.serialize())
+
+
+# Background task, writes at most once every storage.SAVE_INTERVAL seconds
+async def saveLoop():
+    while True:
+        await asyncio.sleep(storage.SAVE_INTERVAL)
+        await flush()